@@ -1,8 +1,7 @@
 import streamlit as st
 import plotly.express as px
-from datetime import datetime, timedelta
 import pandas as pd
-from ga4_utils import fetch_conversoes_por_canal
+from ga4_utils import fetch_canais_comparativo
 
 def aba_canais_aquisicao(property_id, start_date, end_date, customer_root):
     st.subheader("📣 Canais de Aquisição")
@@ -15,16 +14,10 @@ def aba_canais_aquisicao(property_id, start_date, end_date, customer_root):
 - Compare o desempenho com o período anterior e avalie onde investir melhor.
 """)
 
-    # Período atual
-    df_canais = fetch_conversoes_por_canal(property_id, start_date, end_date, customer_root)
-
-    # Período anterior
-    inicio_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    fim_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    dias = (fim_dt - inicio_dt).days + 1
-    inicio_ant = (inicio_dt - timedelta(days=dias)).strftime("%Y-%m-%d")
-    fim_ant = (inicio_dt - timedelta(days=1)).strftime("%Y-%m-%d")
-    df_ant = fetch_conversoes_por_canal(property_id, inicio_ant, fim_ant, customer_root)
+    # Período atual e anterior (uma única requisição)
+    comparativo = fetch_canais_comparativo(property_id, start_date, end_date, customer_root)
+    df_canais = comparativo[comparativo["Período"] == "atual"].drop(columns="Período").reset_index(drop=True)
+    df_ant = comparativo[comparativo["Período"] == "anterior"].drop(columns="Período").reset_index(drop=True)
 
     # Cálculo de variação por canal
     if not df_canais.empty and not df_ant.empty:
@@ -1,35 +1,14 @@
 import streamlit as st
-from diagnostico_utils import coletar_dados_dashboard, gerar_prompt, chamar_ia, exportar_docx
+from diagnostico_utils import coletar_dados_dashboard, gerar_prompt, transmitir_ia, resposta_guardada, exportar_docx
 
 def aba_diagnostico_ia(property_id, start_date, end_date, customer_root):
     st.subheader("📋 Diagnóstico IA - Inteligência Aplicada aos Dados")
 
-    with st.spinner("Analisando dados e gerando diagnóstico com IA..."):
+    with st.spinner("Coletando os dados do dashboard..."):
         dados = coletar_dados_dashboard(property_id, start_date, end_date, customer_root)
 
-        # Adiciona resumo interpretável para refinar o prompt
-        kpis = dados.get("kpis", {})
-        funil = dados.get("funil", {})
-        abandono = dados.get("abandono", {})
-        dispositivo = dados.get("dispositivo_destaque", "n/d")
-        cidade = dados.get("cidade_top", "n/d")
-        produto_top = dados.get("ponto_forte", {})
-        produto_nome = produto_top.get("Produto", "n/d") if produto_top else "n/d"
-        receita = produto_top.get("Receita (R$)", 0.0)
-
-        contexto_extra = f"""
----
-📊 Contexto adicional:
-- Dispositivo com mais sessões: {dispositivo}
-- Cidade com mais acessos: {cidade}
-- Produto de maior receita: {produto_nome} (R$ {receita:.2f})
-- Abandono no carrinho: {max(abandono.get("taxa_abandono_carrinho", 0), 0):.2f}%
-- Abandono no checkout: {max(abandono.get("taxa_abandono_checkout", 0), 0):.2f}%
-- Funil de conversão: {funil.get("sessao", 0)} sessões > {funil.get("carrinho", 0)} carrinhos > {funil.get("checkout", 0)} checkouts > {funil.get("compra", 0)} compras
-"""
-
-        prompt = gerar_prompt(dados, customer_root or "Todos", start_date, end_date) + contexto_extra
-        resposta = chamar_ia(prompt)
+        # Funil, abandono, canais, produtos, páginas etc. já vêm resumidos dentro do orçamento do prompt
+        prompt = gerar_prompt(dados, customer_root or "Todos", start_date, end_date)
 
     st.markdown("""
 ### 🤖 Diagnóstico Estratégico com IA
@@ -49,7 +28,23 @@ Ela é feita por um agente inteligente especializado em performance de e-commerc
 - Perguntas estratégicas que ajudam a tomar decisões
 """)
 
-    st.text_area("Resposta da IA:", resposta, height=400)
+    # A IA só é chamada pelo botão; a resposta fica na sessão e no cache persistente
+    # (aparece direto para quem abrir o mesmo período) enquanto os dados não mudarem
+    escopo = f"diagnostico|{property_id}|{customer_root or 'todos'}|{start_date}|{end_date}"
+    if st.button("🤖 Gerar diagnóstico com IA", key="gerar_diagnostico_ia"):
+        # O texto aparece enquanto é gerado; clicar em Cancelar reexecuta o script,
+        # o que interrompe a transmissão e fecha a conexão com o modelo
+        st.button("⏹️ Cancelar", key="cancelar_diagnostico_ia")
+        with st.container(border=True):
+            resposta = st.write_stream(transmitir_ia(prompt, dados, escopo))
+        st.session_state["diagnostico_ia"] = (prompt, resposta)
+        st.rerun()
+    salvo = st.session_state.get("diagnostico_ia")
+    resposta = salvo[1] if salvo and salvo[0] == prompt else resposta_guardada(prompt, dados)
+    if resposta is None:
+        st.info("Clique no botão para gerar o diagnóstico deste período.")
+    else:
+        st.text_area("Resposta da IA:", resposta, height=400)
 
     st.markdown("""
 ### 💡 Perguntas que você pode explorar com a IA:
@@ -60,6 +55,9 @@ Ela é feita por um agente inteligente especializado em performance de e-commerc
 - Vale a pena criar uma oferta para o produto mais visualizado?
 """)
 
+    if resposta is None:
+        return
+
     docx_path = exportar_docx(resposta)
     with open(docx_path, "rb") as f:
         st.download_button("📥 Baixar Diagnóstico em .docx", f, file_name="diagnostico-estrategico.docx")
@@ -68,5 +66,6 @@ Ela é feita por um agente inteligente especializado em performance de e-commerc
         nova_pergunta = st.text_input("Digite sua pergunta:")
         if st.button("Perguntar para IA") and nova_pergunta:
             pergunta_prompt = prompt + f"\n\n🧠 Pergunta adicional do cliente:\n{nova_pergunta}"
-            nova_resposta = chamar_ia(pergunta_prompt)
-            st.text_area("Resposta da IA:", nova_resposta, height=300)
+            st.button("⏹️ Cancelar", key="cancelar_pergunta_ia")
+            with st.container(border=True):
+                st.write_stream(transmitir_ia(pergunta_prompt, dados, escopo))
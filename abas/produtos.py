@@ -1,14 +1,14 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
 import plotly.express as px
-from ga4_utils import fetch_produtos_mais_vendidos, fetch_produtos_abandonados, fetch_categorias_mais_vendidas
+from ga4_utils import fetch_produtos_comparativo, fetch_produtos_abandonados, fetch_categorias_mais_vendidas
 
 def aba_produtos_categorias(property_id, start_date, end_date, customer_root):
     st.subheader("📊 Visão Detalhada por Produto e Categoria")
 
-    # Período atual
-    vendidos = fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root)
+    # Período atual e anterior (uma única requisição)
+    comparativo = fetch_produtos_comparativo(property_id, start_date, end_date, customer_root)
+    vendidos = comparativo[comparativo["Período"] == "atual"].drop(columns="Período")
     abandonados = fetch_produtos_abandonados(property_id, start_date, end_date, customer_root)
     vendidos = vendidos.rename(columns={"Produto": "Nome do item"})
     abandonados = abandonados.rename(columns={"Produto": "Nome do item"})
@@ -18,14 +18,7 @@ def aba_produtos_categorias(property_id, start_date, end_date, customer_root):
     df["Itens comprados"] = df["Quantidade Vendida"].astype(int)
     df["Receita do item"] = df["Receita (R$)"].astype(float)
 
-    # Período anterior
-    inicio_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    fim_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    dias = (fim_dt - inicio_dt).days + 1
-    inicio_ant = (inicio_dt - timedelta(days=dias)).strftime("%Y-%m-%d")
-    fim_ant = (inicio_dt - timedelta(days=1)).strftime("%Y-%m-%d")
-
-    vendidos_ant = fetch_produtos_mais_vendidos(property_id, inicio_ant, fim_ant, customer_root)
+    vendidos_ant = comparativo[comparativo["Período"] == "anterior"].drop(columns="Período")
     vendidos_ant = vendidos_ant.rename(columns={"Produto": "Nome do item"})
 
     # Variação de receita por produto
@@ -0,0 +1,38 @@
+import streamlit as st
+import plotly.express as px
+from ga4_utils import fetch_ranking_clientes
+
+def aba_ranking_clientes(property_id, start_date, end_date, customer_root):
+    st.subheader("🏁 Ranking de Clientes")
+
+    st.markdown("""
+### Como interpretar:
+
+- Visão consolidada de **todos os clientes** no período, vinda de um único relatório do GA4.
+- Compare **receita, vendas, conversão e ticket médio** entre os clientes.
+- O funil mostra sessões, carrinhos, checkouts e compras de cada cliente.
+""")
+
+    ranking, canais = fetch_ranking_clientes(property_id, start_date, end_date)
+    if ranking.empty:
+        st.info("Nenhum dado de clientes no período selecionado.")
+        return
+
+    st.dataframe(
+        ranking.drop(columns="customer_root").style.format({
+            "Receita (R$)": "R$ {:,.2f}",
+            "Taxa de Conversão": "{:.2%}",
+            "Ticket Médio (R$)": "R$ {:,.2f}"
+        }),
+        use_container_width=True
+    )
+
+    fig = px.bar(ranking, x="Receita (R$)", y="Cliente", orientation="h",
+                 title="💰 Receita por Cliente", color="Receita (R$)",
+                 color_continuous_scale="Blues", template="plotly_dark", height=500)
+    fig.update_layout(yaxis={"categoryorder": "total ascending"})
+    st.plotly_chart(fig, use_container_width=True)
+
+    fig_canais = px.bar(canais, x="Receita (R$)", y="Cliente", color="Canal", orientation="h",
+                        title="📣 Receita por Canal e Cliente", template="plotly_dark", height=500)
+    st.plotly_chart(fig_canais, use_container_width=True)
@@ -1,13 +1,13 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime, timedelta
 from ga4_utils import (
-    fetch_ga4_kpis,
-    fetch_conversoes_por_canal,
-    fetch_produtos_mais_vendidos,
+    fetch_kpis_comparativo,
+    kpis_do_periodo,
+    fetch_canais_comparativo,
+    fetch_produtos_comparativo,
     fetch_regioes_mais_acessadas
 )
-from diagnostico_utils import gerar_prompt, chamar_ia, exportar_docx
+from diagnostico_utils import gerar_prompt, resumir_kpis, transmitir_ia, resposta_guardada, exportar_docx
 
 def aba_resumo_executivo(property_id, start_date, end_date, customer_root):
     st.subheader("📌 Resumo Executivo de Performance")
@@ -23,18 +23,11 @@ Este painel resume os principais indicadores de performance do seu e-commerce co
 - **Destaques:** Canais, produtos e regiões com melhor desempenho.
 """)
 
-    # === KPIs ATUAIS ===
-    kpis = fetch_ga4_kpis(property_id, start_date, end_date, customer_root)
-
-    # === CÁLCULO DO PERÍODO ANTERIOR ===
-    inicio_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    fim_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    dias_periodo = (fim_dt - inicio_dt).days + 1
-
-    inicio_anterior = (inicio_dt - timedelta(days=dias_periodo)).strftime("%Y-%m-%d")
-    fim_anterior = (inicio_dt - timedelta(days=1)).strftime("%Y-%m-%d")
-
-    kpis_anterior = fetch_ga4_kpis(property_id, inicio_anterior, fim_anterior, customer_root)
+    # === KPIs ATUAIS, PERÍODO ANTERIOR E ANO ANTERIOR (uma única requisição) ===
+    comparativo = fetch_kpis_comparativo(property_id, start_date, end_date, customer_root)
+    kpis = kpis_do_periodo(comparativo, "atual")
+    kpis_anterior = kpis_do_periodo(comparativo, "anterior")
+    kpis_ano_anterior = kpis_do_periodo(comparativo, "ano_anterior")
 
     def calc_var(novo, antigo):
         if antigo == 0:
@@ -54,10 +47,17 @@ Este painel resume os principais indicadores de performance do seu e-commerce co
     col2.metric("Vendas", f"{kpis['vendas']}", variacoes["vendas"])
     col3.metric("Taxa de Conversão", f"{kpis['taxa_conversao']:.2%}", variacoes["conversao"])
     col4.metric("Ticket Médio", f"R$ {kpis['ticket_medio']:,.2f}".replace(".", ","), variacoes["ticket"])
+    st.caption(
+        f"Em relação ao mesmo período do ano anterior: receita {calc_var(kpis['receita_total'], kpis_ano_anterior['receita_total'])}, "
+        f"vendas {calc_var(kpis['vendas'], kpis_ano_anterior['vendas'])}."
+    )
 
     # === DESTAQUES ===
-    canais = fetch_conversoes_por_canal(property_id, start_date, end_date, customer_root)
-    produtos = fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root)
+    # Canais e produtos do período atual, das mesmas requisições usadas nas abas de detalhe
+    canais = fetch_canais_comparativo(property_id, start_date, end_date, customer_root)
+    canais = canais[canais["Período"] == "atual"]
+    produtos = fetch_produtos_comparativo(property_id, start_date, end_date, customer_root)
+    produtos = produtos[produtos["Período"] == "atual"]
     regioes = fetch_regioes_mais_acessadas(property_id, start_date, end_date, customer_root)
 
     top_canal = canais.iloc[0]['Canal'] if not canais.empty else 'N/D'
@@ -76,17 +76,28 @@ Este painel resume os principais indicadores de performance do seu e-commerce co
     col7.success(f"Top Região: {top_regiao}")
 
     # === DIAGNÓSTICO RESUMIDO ===
+    # A IA só é chamada pelo botão; a resposta fica na sessão e no cache persistente
+    # enquanto os dados não mudarem
     with st.expander("🤖 Ver Diagnóstico Estratégico com IA"):
         dados_sinteticos = {
             "kpis": kpis,
-            "top_canal": top_canal,
-            "top_produto": top_produto,
-            "top_regiao": top_regiao
+            "destaques": {"canal": top_canal, "produto": top_produto, "regiao": top_regiao},
+            "resumos": {"Variação dos KPIs": resumir_kpis(comparativo)}
         }
         prompt = gerar_prompt(dados_sinteticos, customer_root or "Todos", start_date, end_date)
-        resultado = chamar_ia(prompt)
-        st.text_area("Diagnóstico IA:", resultado, height=300)
+        escopo = f"resumo|{property_id}|{customer_root or 'todos'}|{start_date}|{end_date}"
+        if st.button("Gerar diagnóstico", key="gerar_resumo_ia"):
+            # Transmite o texto enquanto é gerado; Cancelar interrompe a geração
+            st.button("⏹️ Cancelar", key="cancelar_resumo_ia")
+            with st.container(border=True):
+                resposta = st.write_stream(transmitir_ia(prompt, dados_sinteticos, escopo))
+            st.session_state["resumo_ia"] = (prompt, resposta)
+            st.rerun()
+        salvo = st.session_state.get("resumo_ia")
+        resultado = salvo[1] if salvo and salvo[0] == prompt else resposta_guardada(prompt, dados_sinteticos)
+        if resultado:
+            st.text_area("Diagnóstico IA:", resultado, height=300)
 
-        docx_path = exportar_docx(resultado)
-        with open(docx_path, "rb") as f:
-            st.download_button("📥 Baixar Relatório .docx", f, file_name="resumo-executivo.docx")
+            docx_path = exportar_docx(resultado)
+            with open(docx_path, "rb") as f:
+                st.download_button("📥 Baixar Relatório .docx", f, file_name="resumo-executivo.docx")
@@ -0,0 +1,40 @@
+import streamlit as st
+from ga4_utils import fetch_tempo_real, MINUTOS_TEMPO_REAL
+from resiliencia_utils import GA4IndisponivelError
+
+# Intervalo de atualização do painel ao vivo; só o fragmento roda de novo,
+# sem reexecutar o script nem os relatórios das abas
+INTERVALO_TEMPO_REAL = 30
+
+ETAPAS = {"sessao": "Sessões", "carrinho": "Carrinhos", "checkout": "Checkouts", "compra": "Compras"}
+
+
+@st.fragment(run_every=INTERVALO_TEMPO_REAL)
+def painel_tempo_real(property_id, customer_root):
+    st.subheader(f"🔴 Ao vivo - últimos {MINUTOS_TEMPO_REAL} minutos")
+    chave = f"tempo_real_{customer_root or 'todos'}"
+    try:
+        dados = fetch_tempo_real(property_id, customer_root)
+    except GA4IndisponivelError as erro:
+        # Inclui GA4RecusouError: os erros da API (cota, permissão) chegam embrulhados
+        st.caption(f"⚠️ {erro} Nova tentativa em {INTERVALO_TEMPO_REAL}s.")
+        return
+
+    # Variação desde a última atualização desta sessão
+    anterior = st.session_state.get(chave)
+    st.session_state[chave] = dados
+
+    def variacao(atual, valor_anterior):
+        return None if anterior is None else atual - valor_anterior
+
+    colunas = st.columns(2 + len(ETAPAS))
+    colunas[0].metric("Usuários ativos", dados["usuarios_ativos"],
+                      variacao(dados["usuarios_ativos"], anterior and anterior["usuarios_ativos"]))
+    colunas[1].metric("Visualizações", dados["visualizacoes"],
+                      variacao(dados["visualizacoes"], anterior and anterior["visualizacoes"]))
+    for coluna, (etapa, rotulo) in zip(colunas[2:], ETAPAS.items()):
+        coluna.metric(rotulo, dados["funil"][etapa],
+                      variacao(dados["funil"][etapa], anterior and anterior["funil"][etapa]))
+
+    st.bar_chart(dados["por_minuto"], x="Minutos atrás", y="Usuários ativos", height=160)
+    st.caption(f"Atualiza a cada {INTERVALO_TEMPO_REAL}s.")
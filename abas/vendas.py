@@ -1,6 +1,5 @@
 import streamlit as st
-from datetime import datetime, timedelta
-from ga4_utils import fetch_ga4_kpis, fetch_funil_conversao, fetch_receita_transacoes_por_dia
+from ga4_utils import fetch_kpis_comparativo, kpis_do_periodo, fetch_funil_conversao, fetch_receita_transacoes_por_dia
 import plotly.graph_objects as go
 import plotly.express as px
 
@@ -8,16 +7,10 @@ import plotly.express as px
 def aba_vendas_receita(property_id, start_date, end_date, customer_root):
     st.subheader("🔹 Vendas e Receita")
 
-    # KPIs atuais
-    kpis = fetch_ga4_kpis(property_id, start_date, end_date, customer_root)
-
-    # Período anterior
-    inicio_dt = datetime.strptime(start_date, "%Y-%m-%d")
-    fim_dt = datetime.strptime(end_date, "%Y-%m-%d")
-    dias_periodo = (fim_dt - inicio_dt).days + 1
-    inicio_ant = (inicio_dt - timedelta(days=dias_periodo)).strftime("%Y-%m-%d")
-    fim_ant = (inicio_dt - timedelta(days=1)).strftime("%Y-%m-%d")
-    kpis_ant = fetch_ga4_kpis(property_id, inicio_ant, fim_ant, customer_root)
+    # KPIs atuais e do período anterior (uma única requisição)
+    comparativo = fetch_kpis_comparativo(property_id, start_date, end_date, customer_root)
+    kpis = kpis_do_periodo(comparativo, "atual")
+    kpis_ant = kpis_do_periodo(comparativo, "anterior")
 
     def calc_var(novo, antigo):
         if antigo == 0:
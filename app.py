@@ -6,7 +6,7 @@ import streamlit as st
 import pandas as pd
 import bcrypt
 from dotenv import load_dotenv
-from config import nomes_amigaveis
+from config import nomes_amigaveis, PROPERTY_ID, RELATORIOS_POR_ABA
 from painel_admin import painel_administrativo
 
 # IMPORTAÇÕES DE UTILITÁRIOS
@@ -18,6 +18,10 @@ from diagnostico_utils import (
     exportar_docx
 )
 from ga4_utils import *
+from cota_utils import CotaEsgotadaError
+from resiliencia_utils import GA4IndisponivelError, GA4RecusouError
+from cache_utils import hoje_na_propriedade, medir_idade, descrever_idade
+from metricas_utils import medir, iniciar_servidor_metricas
 from abas.vendas import aba_vendas_receita
 from abas.produtos import aba_produtos_categorias
 from abas.canais import aba_canais_aquisicao
@@ -25,10 +29,13 @@ from abas.engajamento import aba_engajamento_regioes
 from abas.paginas import aba_paginas_carrinho
 from abas.diagnostico import aba_diagnostico_ia
 from abas.resumo import aba_resumo_executivo
+from abas.ranking import aba_ranking_clientes
+from abas.tempo_real import painel_tempo_real
 
 # === CONFIGURAÇÃO ===
 load_dotenv()
 st.set_page_config(page_title="Dashboard GA4 + IA", layout="wide")
+iniciar_servidor_metricas()
 
 # === CONTROLE DE SESSÃO ===
 if "logado" not in st.session_state:
@@ -73,15 +80,8 @@ st.title("📊 Visão Geral de Performance - GA4")
 
 # === SIDEBAR ===
 st.sidebar.header("📅 Período")
-hoje = datetime.date.today()
-atalhos = {
-    "Hoje": (hoje, hoje),
-    "Ontem": (hoje - datetime.timedelta(days=1), hoje - datetime.timedelta(days=1)),
-    "Últimos 7 dias": (hoje - datetime.timedelta(days=6), hoje),
-    "Últimos 30 dias": (hoje - datetime.timedelta(days=29), hoje),
-    "Este mês": (hoje.replace(day=1), hoje),
-    "Mês anterior": ((hoje.replace(day=1) - datetime.timedelta(days=1)).replace(day=1), hoje.replace(day=1) - datetime.timedelta(days=1))
-}
+hoje = hoje_na_propriedade()
+atalhos = atalhos_periodo(hoje)
 opcao_intervalo = st.sidebar.selectbox("Selecione um intervalo:", list(atalhos.keys()) + ["Personalizado"], index=2)
 if opcao_intervalo == "Personalizado":
     col1, col2 = st.sidebar.columns(2)
@@ -110,10 +110,13 @@ if st.sidebar.button("🚪 Sair"):
     st.rerun()
 
 
-PROPERTY_ID = "378239992"
 def filtros():
     return PROPERTY_ID, str(data_inicio), str(data_fim), CUSTOMER_ROOT
 
+# "Hoje" ganha o painel ao vivo, que se atualiza sozinho sem rodar o resto da página
+if opcao_intervalo == "Hoje":
+    painel_tempo_real(PROPERTY_ID, CUSTOMER_ROOT)
+
 # === ABAS ===
 aba_labels = [
     "📌 Resumo Executivo",
@@ -126,18 +129,62 @@ aba_labels = [
 ]
 
 if st.session_state.get("cliente") is None:
+    aba_labels.append("🏁 Ranking de Clientes")
     aba_labels.append("⚙️ Administração")
 
-abas = st.tabs(aba_labels)
-
-with abas[0]: aba_resumo_executivo(*filtros())
-with abas[1]: aba_vendas_receita(*filtros())
-with abas[2]: aba_produtos_categorias(*filtros())
-with abas[3]: aba_canais_aquisicao(*filtros())
-with abas[4]: aba_engajamento_regioes(*filtros())
-with abas[5]: aba_paginas_carrinho(*filtros())
-with abas[6]: aba_diagnostico_ia(*filtros())
+FUNCOES_ABAS = {
+    "📌 Resumo Executivo": aba_resumo_executivo,
+    "Vendas e Receita": aba_vendas_receita,
+    "Produtos e Categorias": aba_produtos_categorias,
+    "Canais de Aquisição": aba_canais_aquisicao,
+    "Engajamento e Regiões": aba_engajamento_regioes,
+    "Páginas e Carrinho": aba_paginas_carrinho,
+    "📋 Diagnóstico IA": aba_diagnostico_ia,
+    "🏁 Ranking de Clientes": aba_ranking_clientes
+}
 
-if len(aba_labels) > 7:
-    with abas[7]:
-        painel_administrativo()
+# Só a aba escolhida roda: ao contrário de st.tabs, as outras não buscam
+# relatórios nem renderizam nada a cada interação
+if st.session_state.get("aba_ativa") not in aba_labels:
+    st.session_state["aba_ativa"] = aba_labels[0]
+aba_ativa = st.radio("Seção", aba_labels, horizontal=True, key="aba_ativa", label_visibility="collapsed")
+
+# Busca em paralelo, num único lote, os relatórios da aba escolhida
+try:
+    relatorios_aba = RELATORIOS_POR_ABA.get(aba_ativa, [])
+    if relatorios_aba:
+        with st.spinner("Carregando relatórios do GA4..."):
+            pre_carregar_relatorios(*filtros(), relatorios=relatorios_aba)
+except CotaEsgotadaError as erro:
+    st.warning(f"⏳ {erro}")
+    st.stop()
+except GA4IndisponivelError as erro:
+    # Cada aba tenta de novo (ou falha na hora, com o circuito aberto) e mostra o próprio aviso
+    st.warning(f"⚠️ {erro}")
+
+
+def exibir_aba(aba, funcao):
+    """Renderiza a aba; uma falha do GA4 vira aviso só nela, sem derrubar a página.
+
+    Ao final mostra a idade do dado mais antigo que a aba usou.
+    """
+    with aba:
+        try:
+            with medir_idade() as instantes, medir("aba_segundos", aba=funcao.__name__):
+                funcao(*filtros())
+        except CotaEsgotadaError as erro:
+            st.warning(f"⏳ {erro}")
+        except GA4RecusouError as erro:
+            # Sem dado em cache para servir no lugar; repetir não resolve
+            st.error(f"⚠️ {erro}")
+        except GA4IndisponivelError as erro:
+            st.error(f"⚠️ {erro} Tente recarregar a página em instantes.")
+        idade = descrever_idade(instantes)
+        if idade:
+            st.caption(f"🕒 {idade}")
+
+
+if aba_ativa == "⚙️ Administração":
+    painel_administrativo()
+else:
+    exibir_aba(st.container(), FUNCOES_ABAS[aba_ativa])
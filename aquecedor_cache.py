@@ -0,0 +1,85 @@
+"""Aquecedor do cache de relatórios GA4.
+
+Processo separado do Streamlit que, para cada cliente de config.nomes_amigaveis
+(e para "Todos os clientes") e cada atalho de período do app, carrega os
+relatórios que as abas usam (config.RELATORIOS_POR_ABA, período atual e
+comparações). Tudo vai para o cache em disco compartilhado, então o primeiro
+acesso do dia já abre com os dados prontos.
+
+O agendador de cota é por processo: o aquecedor gasta a mesma cota do GA4 que
+as sessões abertas, então convém rodá-lo fora do horário de uso.
+
+Uso:
+    python aquecedor_cache.py                  # uma passada e sai
+    python aquecedor_cache.py --intervalo 60   # repete a cada 60 minutos
+    python aquecedor_cache.py --simultaneos 2 --atalhos "Ontem" "Últimos 7 dias"
+"""
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from config import nomes_amigaveis, PROPERTY_ID, RELATORIOS_POR_ABA
+from cache_utils import hoje_na_propriedade
+from cota_utils import segundo_plano
+from ga4_utils import atalhos_periodo, pre_carregar_relatorios
+import diagnostico_utils  # noqa: F401 (registra coletar_dados_dashboard em RELATORIOS)
+
+logger = logging.getLogger("aquecedor_cache")
+
+# Tarefas (cliente × atalho) aquecidas ao mesmo tempo; cada uma ainda divide
+# os lotes com o pool do ga4_utils e passa pelo agendador de cota
+SIMULTANEOS_PADRAO = 2
+
+# Só o que alguma aba usa; relatórios registrados e sem aba não gastam cota
+RELATORIOS_USADOS = sorted({nome for nomes in RELATORIOS_POR_ABA.values() for nome in nomes})
+
+
+def aquecer(customer_root, nome_atalho, inicio, fim):
+    # O ranking só aparece para quem vê todos os clientes
+    relatorios = [nome for nome in RELATORIOS_USADOS if customer_root is None or nome != "fetch_ranking_clientes"]
+    with segundo_plano():
+        pre_carregar_relatorios(PROPERTY_ID, str(inicio), str(fim), customer_root, relatorios=relatorios)
+
+
+def passada(atalhos=None, simultaneos=SIMULTANEOS_PADRAO):
+    """Aquece todos os clientes × atalhos; devolve (tarefas ok, tarefas com erro)."""
+    periodos = atalhos_periodo(hoje_na_propriedade())
+    if atalhos:
+        periodos = {nome: periodos[nome] for nome in atalhos}
+    clientes = [None] + list(nomes_amigaveis)
+    tarefas = [(cliente, nome, *periodo) for cliente in clientes for nome, periodo in periodos.items()]
+
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=simultaneos, thread_name_prefix="aquecedor") as executor:
+        futuros = {executor.submit(aquecer, *tarefa): tarefa for tarefa in tarefas}
+    erros = 0
+    for futuro, (cliente, nome, _, _) in futuros.items():
+        try:
+            futuro.result()
+        except Exception:
+            erros += 1
+            logger.exception("Falha ao aquecer %s / %s", cliente or "Todos", nome)
+    logger.info("Passada concluída: %d tarefas, %d com erro, %.0fs",
+                len(tarefas), erros, time.monotonic() - inicio)
+    return len(tarefas) - erros, erros
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aquece o cache de relatórios GA4 para todos os clientes.")
+    parser.add_argument("--intervalo", type=float, default=0,
+                        help="minutos entre passadas (0 = uma passada e sai)")
+    parser.add_argument("--simultaneos", type=int, default=SIMULTANEOS_PADRAO,
+                        help="tarefas cliente × atalho em paralelo")
+    parser.add_argument("--atalhos", nargs="*", help="atalhos a aquecer (padrão: todos)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    while True:
+        passada(args.atalhos, args.simultaneos)
+        if not args.intervalo:
+            break
+        time.sleep(args.intervalo * 60)
+
+
+if __name__ == "__main__":
+    main()
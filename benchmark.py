@@ -0,0 +1,201 @@
+"""Benchmark dos fetch_*, das abas e do coletar_dados_dashboard sobre o GA4 simulado.
+
+Roda com o cliente de ga4_simulado (respostas sintéticas de N linhas) e um
+cache em disco temporário, para cada tamanho pedido:
+    frio    caches vazios: chamada ao GA4 simulado, decodificação e gravação
+            (as respostas sintéticas ficam memorizadas no cliente simulado,
+            então o tempo de gerá-las não entra)
+    disco   só o cache em memória vazio: leitura do cache em disco
+    render  dados já em memória: transformações do pandas, gráficos e st.*
+A chamada à IA das abas é trocada por uma resposta fixa; o tempo do LLM não
+entra nos números e não é preciso nenhuma credencial (GA4 ou Groq).
+
+Uso:
+    python benchmark.py --saida base.json
+    python benchmark.py --tamanhos 100 1000 --repeticoes 5 --saida novo.json
+    python benchmark.py --comparar base.json novo.json --tolerancia 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import logging
+import platform
+import argparse
+import statistics
+import tempfile
+from unittest import mock
+
+# O cache precisa ir para um diretório descartável antes de config ser importado;
+# sempre um novo, pois _limpar_disco apaga o diretório inteiro
+os.environ["GA4_CACHE_DIR"] = tempfile.mkdtemp(prefix="benchmark_ga4_")
+os.environ["IA_CACHE_ARQUIVO"] = os.path.join(tempfile.mkdtemp(prefix="benchmark_ia_"), "respostas_ia.db")
+os.environ["GA4_MODO"] = "simulado"
+
+import pandas as pd
+from streamlit import logger as st_logger
+import ga4_utils
+import cache_utils
+import diagnostico_utils
+from ga4_simulado import ClienteGA4Simulado
+from abas.resumo import aba_resumo_executivo
+from abas.vendas import aba_vendas_receita
+from abas.produtos import aba_produtos_categorias
+from abas.canais import aba_canais_aquisicao
+from abas.engajamento import aba_engajamento_regioes
+from abas.paginas import aba_paginas_carrinho
+from abas.ranking import aba_ranking_clientes
+from abas.diagnostico import aba_diagnostico_ia
+
+TAMANHOS_PADRAO = [100, 1000, 10000, 100000]
+REPETICOES_PADRAO = 3
+TOLERANCIA_PADRAO = 0.2
+# Diferenças menores que isso são ruído de medição, qualquer que seja a variação relativa
+DIFERENCA_MINIMA_S = 0.005
+PROPRIEDADE = "benchmark"
+INICIO, FIM = "2025-01-01", "2025-01-30"
+CLIENTE = "cemaco"
+RESPOSTA_IA = "Diagnóstico de benchmark."
+
+# Só os relatórios por período; o tempo real não recebe datas nem passa pelo cache em disco
+FETCHERS = {
+    nome: funcao for nome, funcao in vars(ga4_utils).items()
+    if nome.startswith("fetch_") and "start_date" in inspect.signature(funcao).parameters
+}
+ABAS = [
+    aba_resumo_executivo, aba_vendas_receita, aba_produtos_categorias, aba_canais_aquisicao,
+    aba_engajamento_regioes, aba_paginas_carrinho, aba_ranking_clientes, aba_diagnostico_ia
+]
+
+
+def _limpar_memoria():
+    for funcao in list(FETCHERS.values()) + [diagnostico_utils.coletar_dados_dashboard]:
+        if hasattr(funcao, "clear"):
+            funcao.clear()
+
+
+def _limpar_disco():
+    shutil.rmtree(cache_utils.CACHE_DIR, ignore_errors=True)
+
+
+def _chamada(alvo):
+    """Função sem argumentos que executa o alvo para o período e cliente do benchmark."""
+    parametros = inspect.signature(alvo).parameters
+    argumentos = [PROPRIEDADE, INICIO, FIM]
+    if "customer_root" in parametros:
+        argumentos.append(None if alvo is aba_ranking_clientes else CLIENTE)
+    return lambda: alvo(*argumentos)
+
+
+def _cronometrar(chamada, preparar, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        preparar()
+        inicio = time.perf_counter()
+        chamada()
+        tempos.append(time.perf_counter() - inicio)
+    return {
+        "mediana_s": round(statistics.median(tempos), 6),
+        "min_s": round(min(tempos), 6),
+        "max_s": round(max(tempos), 6)
+    }
+
+
+def medir(tamanhos, repeticoes, latencia_ms=0):
+    resultados = []
+    alvos = [("fetch", nome, funcao) for nome, funcao in sorted(FETCHERS.items())]
+    alvos += [("aba", aba.__name__, aba) for aba in ABAS]
+    alvos.append(("diagnostico", "coletar_dados_dashboard", diagnostico_utils.coletar_dados_dashboard))
+
+    def frio():
+        _limpar_memoria()
+        _limpar_disco()
+
+    for linhas in tamanhos:
+        ga4_utils._cliente_ga4 = ClienteGA4Simulado(linhas=linhas, latencia_ms=latencia_ms, tokens_por_hora=10 ** 9)
+        for tipo, nome, alvo in alvos:
+            chamada = _chamada(alvo)
+            chamada()  # aquece imports e o cache em disco para o modo "disco"
+            modos = {"frio": frio, "disco": _limpar_memoria}
+            if tipo != "fetch":
+                modos["render"] = lambda: None
+            for modo, preparar in modos.items():
+                tempos = _cronometrar(chamada, preparar, repeticoes)
+                resultados.append({"alvo": nome, "tipo": tipo, "linhas": linhas, "modo": modo, **tempos})
+                logging.info("%-40s %7d linhas %-6s %.4fs", nome, linhas, modo, tempos["mediana_s"])
+    return resultados
+
+
+def comparar(base, novo, tolerancia=TOLERANCIA_PADRAO):
+    """Lista as medições de novo mais lentas que as de base além da tolerância."""
+    chave = lambda r: (r["alvo"], r["linhas"], r["modo"])
+    anteriores = {chave(r): r for r in base["resultados"]}
+    regressoes = []
+    for resultado in novo["resultados"]:
+        anterior = anteriores.get(chave(resultado))
+        if not anterior or not anterior["mediana_s"]:
+            continue
+        variacao = resultado["mediana_s"] / anterior["mediana_s"] - 1
+        if variacao > tolerancia and resultado["mediana_s"] - anterior["mediana_s"] > DIFERENCA_MINIMA_S:
+            regressoes.append({**resultado, "anterior_s": anterior["mediana_s"], "variacao": round(variacao, 3)})
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do dashboard GA4 sobre respostas sintéticas.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO,
+                        help="linhas por relatório simulado")
+    parser.add_argument("--repeticoes", type=int, default=REPETICOES_PADRAO)
+    parser.add_argument("--latencia-ms", type=float, default=0, help="latência simulada do GA4")
+    parser.add_argument("--saida", help="arquivo JSON de resultados (padrão: stdout)")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NOVO"),
+                        help="compara dois resultados e sai com erro se houver regressão")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA_PADRAO,
+                        help="aumento relativo da mediana aceito na comparação")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Fora do "streamlit run" cada st.* avisa que não há sessão; só polui a saída
+    st_logger.set_log_level("error")
+
+    if args.comparar:
+        with open(args.comparar[0]) as arquivo:
+            base = json.load(arquivo)
+        with open(args.comparar[1]) as arquivo:
+            novo = json.load(arquivo)
+        regressoes = comparar(base, novo, args.tolerancia)
+        if regressoes:
+            print(pd.DataFrame(regressoes)[["alvo", "linhas", "modo", "anterior_s", "mediana_s", "variacao"]]
+                  .to_string(index=False))
+        else:
+            print("Nenhuma regressão acima da tolerância.")
+        sys.exit(1 if regressoes else 0)
+
+    with mock.patch("abas.resumo.transmitir_ia", side_effect=lambda *_: iter([RESPOSTA_IA])), \
+            mock.patch("abas.diagnostico.transmitir_ia", side_effect=lambda *_: iter([RESPOSTA_IA])):
+        resultados = medir(args.tamanhos, args.repeticoes, args.latencia_ms)
+    _limpar_disco()
+
+    saida = {
+        "metadados": {
+            "executado_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "maquina": platform.machine(),
+            "tamanhos": args.tamanhos,
+            "repeticoes": args.repeticoes,
+            "latencia_ms": args.latencia_ms
+        },
+        "resultados": resultados
+    }
+    texto = json.dumps(saida, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
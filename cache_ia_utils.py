@@ -0,0 +1,117 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+from config import IA_CACHE_ARQUIVO, IA_CACHE_MAX_DIAS, IA_CACHE_MAX_ENTRADAS
+
+logger = logging.getLogger(__name__)
+
+# === CACHE DAS RESPOSTAS DA IA ===
+# Respostas do LLM guardadas em SQLite, compartilhadas entre sessões, processos e
+# reinícios. A chave junta o modelo pedido, o prompt normalizado e a impressão
+# digital dos dados que o geraram: se os dados mudam, a chave muda. Ao gravar uma
+# resposta de um escopo (relatório + cliente + período) com dados novos, as
+# respostas desse escopo feitas sobre os dados antigos são apagadas.
+# Falhas do SQLite só desligam o cache naquela chamada, nunca a chamada à IA.
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS respostas (
+    chave TEXT PRIMARY KEY,
+    escopo TEXT,
+    impressao TEXT NOT NULL,
+    modelo TEXT,
+    resposta TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    usado_em REAL NOT NULL
+)
+"""
+
+_lock = threading.Lock()
+_preparado = False
+
+
+def _conectar():
+    global _preparado
+    conn = sqlite3.connect(IA_CACHE_ARQUIVO, timeout=10)
+    if not _preparado:
+        with _lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_ESQUEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS respostas_escopo ON respostas (escopo)")
+            conn.commit()
+            _preparado = True
+    return conn
+
+
+def normalizar_prompt(prompt):
+    """Prompt sem espaços repetidos nem linhas vazias, para a chave não depender da formatação."""
+    linhas = (" ".join(linha.split()) for linha in prompt.splitlines())
+    return "\n".join(linha for linha in linhas if linha)
+
+
+def impressao_dados(dados):
+    """Hash estável dos dados usados no prompt ("" sem dados)."""
+    if dados is None:
+        return ""
+    texto = json.dumps(dados, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+def chave_resposta(modelo, prompt, impressao):
+    texto = "\0".join([modelo, normalizar_prompt(prompt), impressao])
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def ler_resposta(chave, max_dias=IA_CACHE_MAX_DIAS):
+    """Resposta guardada para a chave, ou None se não houver ou tiver expirado."""
+    agora = time.time()
+    try:
+        with closing(_conectar()) as conn, conn:
+            linha = conn.execute(
+                "SELECT resposta FROM respostas WHERE chave = ? AND criado_em >= ?",
+                (chave, agora - max_dias * 86400)
+            ).fetchone()
+            if linha:
+                conn.execute("UPDATE respostas SET usado_em = ? WHERE chave = ?", (agora, chave))
+    except sqlite3.Error:
+        logger.warning("Falha ao ler o cache de respostas da IA", exc_info=True)
+        return None
+    return linha[0] if linha else None
+
+
+def gravar_resposta(chave, resposta, modelo, impressao, escopo=None,
+                    max_dias=IA_CACHE_MAX_DIAS, max_entradas=IA_CACHE_MAX_ENTRADAS):
+    """Guarda a resposta, invalida as do escopo feitas com outros dados e poda o cache."""
+    agora = time.time()
+    try:
+        with closing(_conectar()) as conn, conn:
+            if escopo:
+                conn.execute("DELETE FROM respostas WHERE escopo = ? AND impressao != ?", (escopo, impressao))
+            conn.execute(
+                "INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (chave, escopo, impressao, modelo, resposta, agora, agora)
+            )
+            conn.execute("DELETE FROM respostas WHERE criado_em < ?", (agora - max_dias * 86400,))
+            conn.execute(
+                "DELETE FROM respostas WHERE chave IN "
+                "(SELECT chave FROM respostas ORDER BY usado_em DESC LIMIT -1 OFFSET ?)",
+                (max_entradas,)
+            )
+    except sqlite3.Error:
+        logger.warning("Falha ao gravar no cache de respostas da IA", exc_info=True)
+
+
+def limpar_cache_ia():
+    """Apaga todas as respostas guardadas; devolve quantas eram."""
+    with closing(_conectar()) as conn, conn:
+        return conn.execute("DELETE FROM respostas").rowcount
+
+
+def estatisticas_cache_ia():
+    with closing(_conectar()) as conn:
+        respostas, escopos = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT escopo) FROM respostas"
+        ).fetchone()
+    return {"respostas": respostas, "escopos": escopos}
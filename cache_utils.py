@@ -0,0 +1,376 @@
+import os
+import re
+import copy
+import time
+import inspect
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from functools import wraps
+import pyarrow as pa
+from config import CACHE_DIR, CACHE_MAX_MB, CACHE_MAX_DIAS, GA4_FUSO_HORARIO
+from cota_utils import segundo_plano
+from metricas_utils import medir, contar
+
+logger = logging.getLogger(__name__)
+
+# === POLÍTICA DE VALIDADE ===
+# O GA4 pode levar até 48 horas para processar um dia, contado no fuso da
+# propriedade (GA4_FUSO_HORARIO), não no do servidor. A validade de cada
+# entrada sai do fim do período consultado: "hoje" expira em minutos, os dois
+# dias anteriores em uma hora e períodos já consolidados em TTL_CONSOLIDADO,
+# longo mas finito, para que uma correção tardia do GA4 acabe aparecendo.
+DIAS_EM_ABERTO = 3
+TTL_HOJE = 5 * 60
+TTL_ONTEM = 60 * 60
+TTL_CONSOLIDADO = 7 * 24 * 60 * 60
+TTL_PADRAO = 3600
+# Depois de expirar, uma entrada ainda é servida por até JANELA_OBSOLETA
+# segundos enquanto é atualizada em segundo plano (stale-while-revalidate)
+JANELA_OBSOLETA = 24 * 60 * 60
+ESPERA_APOS_FALHA = 60
+
+
+def hoje_na_propriedade():
+    """Data de hoje no fuso horário da propriedade GA4."""
+    return datetime.now(ZoneInfo(GA4_FUSO_HORARIO)).date()
+
+
+def ttl_periodo(end_date):
+    """Validade (segundos) de um resultado que vai até end_date."""
+    try:
+        fim = date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        return TTL_PADRAO
+    hoje = hoje_na_propriedade()
+    if fim >= hoje:
+        return TTL_HOJE
+    if fim > hoje - timedelta(days=DIAS_EM_ABERTO):
+        return TTL_ONTEM
+    return TTL_CONSOLIDADO
+
+# === CACHE PERSISTENTE DE RELATÓRIOS ===
+# Cada relatório vira um arquivo Arrow IPC em CACHE_DIR, nomeado pelo hash
+# canônico da requisição. O diretório é compartilhado entre os processos do
+# Streamlit e sobrevive a restarts/deploys. A leitura é feita por memory-map,
+# sem copiar o arquivo para a memória do processo. Séries diárias ficam em
+# partições de um arquivo por dia (ver ler_particao/gravar_particao).
+# VERSAO_FORMATO muda quando o formato das colunas muda, para que arquivos
+# antigos não sejam lidos como se fossem do formato novo.
+VERSAO_FORMATO = "v2"
+
+
+def _caminho_relatorio(chave):
+    return os.path.join(CACHE_DIR, VERSAO_FORMATO, "relatorios", chave[:2], f"{chave}.arrow")
+
+
+def _ler_arrow(caminho):
+    try:
+        with pa.memory_map(caminho, "r") as fonte:
+            return pa.ipc.open_file(fonte).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+
+def _gravar_arrow(caminho, tabela):
+    # Grava em arquivo temporário e troca atomicamente: leitores de outros
+    # processos nunca enxergam um arquivo pela metade.
+    pasta = os.path.dirname(caminho)
+    os.makedirs(pasta, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=pasta, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as arquivo:
+            with pa.ipc.new_file(arquivo, tabela.schema) as escritor:
+                escritor.write_table(tabela)
+        os.replace(temporario, caminho)
+    except Exception:
+        os.remove(temporario)
+        raise
+
+
+def _caminho_particao(serie, dia):
+    return os.path.join(CACHE_DIR, VERSAO_FORMATO, "dias", serie[:2], serie, f"{dia}.arrow")
+
+
+def _ler_df(caminho, ttl, janela_obsoleta=0):
+    tabela = _ler_arrow(caminho)
+    if tabela is None:
+        return None
+    metadados = tabela.schema.metadata or {}
+    criado_em = float(metadados.get(b"criado_em", 0))
+    idade = time.time() - criado_em
+    if ttl is not None and idade > ttl + janela_obsoleta:
+        return None
+    df = tabela.to_pandas(split_blocks=True)
+    df.attrs["criado_em"] = criado_em
+    df.attrs["obsoleto"] = ttl is not None and idade > ttl
+    _anotar_obtido_em(criado_em, None if ttl is None else criado_em + ttl)
+    return df
+
+
+def _gravar_df(caminho, df, criado_em):
+    # O pyarrow guarda df.attrs junto com a tabela; as anotações da leitura
+    # (criado_em, obsoleto...) não devem voltar do disco como se fossem dados
+    df = df.copy(deep=False)
+    df.attrs = {}
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[b"criado_em"] = str(criado_em).encode()
+    _gravar_arrow(caminho, tabela.replace_schema_metadata(metadados))
+    _agendar_limpeza()
+
+
+def ler_relatorio(chave, ttl=TTL_PADRAO, janela_obsoleta=0):
+    """Devolve o DataFrame em cache para a chave, ou None se não existir ou tiver expirado.
+
+    ttl=None aceita a entrada independentemente da idade. Com janela_obsoleta,
+    entradas expiradas há menos que isso ainda são devolvidas, com
+    df.attrs["obsoleto"] = True, para que quem chamou as atualize.
+    """
+    return _ler_df(_caminho_relatorio(chave), ttl, janela_obsoleta)
+
+
+def gravar_relatorio(chave, df, criado_em=None):
+    """Grava o relatório; criado_em (padrão: agora) é quando os dados saíram do GA4. Devolve esse instante."""
+    criado_em = time.time() if criado_em is None else criado_em
+    _anotar_obtido_em(criado_em)
+    _gravar_df(_caminho_relatorio(chave), df, criado_em)
+    return criado_em
+
+
+def ler_particao(serie, dia, ttl=None, janela_obsoleta=0):
+    """Partição de um dia (YYYYMMDD) de uma série diária; ttl=None para dias já consolidados."""
+    return _ler_df(_caminho_particao(serie, dia), ttl, janela_obsoleta)
+
+
+def gravar_particao(serie, dia, df):
+    criado_em = time.time()
+    _anotar_obtido_em(criado_em)
+    _gravar_df(_caminho_particao(serie, dia), df, criado_em)
+
+
+# === IDADE DOS DADOS ===
+# Cada leitura ou gravação do cache anota quando os dados saíram do GA4.
+# medir_idade() coleta essas anotações na thread atual, para a interface
+# mostrar a idade do dado mais antigo que usou. Leituras com validade anotam
+# também quando vencem, para o cache em memória não guardar um resultado
+# montado com dados velhos por mais tempo que eles valem.
+_idades = threading.local()
+
+
+class _Instantes(list):
+    """Instantes de obtenção; vence_em é a menor validade anotada (None: sem validade)."""
+    vence_em = None
+
+
+def _anotar_obtido_em(instante, vence_em=None):
+    for instantes in getattr(_idades, "pilha", []):
+        instantes.append(instante)
+        if vence_em is not None and (instantes.vence_em is None or vence_em < instantes.vence_em):
+            instantes.vence_em = vence_em
+
+
+@contextmanager
+def medir_idade():
+    """Lista com o instante de obtenção de cada dado usado dentro do bloco."""
+    pilha = _idades.__dict__.setdefault("pilha", [])
+    instantes = _Instantes()
+    pilha.append(instantes)
+    try:
+        yield instantes
+    finally:
+        pilha.pop()
+
+
+def descrever_idade(instantes):
+    """Texto curto com a idade do dado mais antigo ("há 12 min")."""
+    if not instantes:
+        return None
+    minutos = int((time.time() - min(instantes)) // 60)
+    if minutos < 1:
+        return "Dados atualizados agora"
+    if minutos < 60:
+        return f"Dados de há {minutos} min"
+    if minutos < 48 * 60:
+        return f"Dados de há {minutos // 60} h"
+    return f"Dados de há {minutos // (24 * 60)} dias"
+
+
+# === LIMPEZA DO CACHE EM DISCO ===
+# Cada período, cliente e relatório gera um arquivo, então o diretório é
+# podado de tempos em tempos (no máximo uma vez por INTERVALO_LIMPEZA por
+# processo, numa thread à parte), só nas pastas criadas pelo cache: saem
+# versões antigas do formato, arquivos temporários órfãos, arquivos com mais
+# de CACHE_MAX_DIAS e, se ainda passar de CACHE_MAX_MB, os gravados há mais
+# tempo.
+INTERVALO_LIMPEZA = 60 * 60
+SUBPASTAS_CACHE = ("relatorios", "dias")
+
+_ultima_limpeza = 0.0
+_lock_limpeza = threading.Lock()
+
+
+def _agendar_limpeza():
+    global _ultima_limpeza
+    with _lock_limpeza:
+        if time.time() - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return
+        _ultima_limpeza = time.time()
+    threading.Thread(target=limpar_cache, name="limpeza-cache-ga4", daemon=True).start()
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def _arquivos_do_cache():
+    """(caminho, é da versão atual?) de cada .arrow/.tmp do próprio cache.
+
+    Só percorre as pastas que o cache cria (vN/relatorios e vN/dias): se
+    CACHE_DIR for um diretório compartilhado, o resto dele não é tocado.
+    """
+    try:
+        versoes = [nome for nome in os.listdir(CACHE_DIR) if re.fullmatch(r"v\d+", nome)]
+    except FileNotFoundError:
+        return
+    for versao in versoes:
+        for subpasta in SUBPASTAS_CACHE:
+            for pasta, _, nomes in os.walk(os.path.join(CACHE_DIR, versao, subpasta)):
+                for nome in nomes:
+                    if nome.endswith((".arrow", ".tmp")):
+                        yield os.path.join(pasta, nome), versao == VERSAO_FORMATO
+
+
+def limpar_cache(max_mb=CACHE_MAX_MB, max_dias=CACHE_MAX_DIAS):
+    """Poda o cache em disco; devolve quantos arquivos foram removidos."""
+    agora = time.time()
+    arquivos = []
+    removidos = 0
+    for caminho, atual in _arquivos_do_cache():
+        try:
+            info = os.stat(caminho)
+        except FileNotFoundError:
+            continue
+        idade = agora - info.st_mtime
+        if not atual or idade > max_dias * 86400 or (caminho.endswith(".tmp") and idade > INTERVALO_LIMPEZA):
+            _remover(caminho)
+            removidos += 1
+        elif caminho.endswith(".arrow"):
+            arquivos.append((info.st_mtime, info.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= max_mb * 1024 * 1024:
+            break
+        _remover(caminho)
+        total -= tamanho
+        removidos += 1
+    return removidos
+
+
+# === CACHE EM MEMÓRIA DOS FETCHERS ===
+# Substitui o st.cache_data(ttl=3600): a validade de cada chamada vem de
+# ttl_periodo(end_date). Devolve cópias, como o st.cache_data,
+# para que as abas possam alterar os DataFrames sem afetar o cache.
+# Entradas expiradas (até JANELA_OBSOLETA) são devolvidas na hora e
+# recalculadas numa thread em segundo plano; se o recálculo falhar, o último
+# valor bom continua sendo servido.
+MAX_ENTRADAS_MEMORIA = 512
+
+
+def cache_por_periodo(funcao):
+    assinatura = inspect.signature(funcao)
+    entradas = OrderedDict()
+    atualizando = set()
+    proxima_tentativa = {}
+    lock = threading.Lock()
+
+    def calcular(chave, args, kwargs, ttl):
+        with medir_idade() as instantes:
+            valor = funcao(*args, **kwargs)
+        agora = time.time()
+        # Vale pelo ttl do período, mas nunca além do dado mais perto de vencer
+        expira_em = instantes.vence_em
+        if ttl is not None:
+            expira_em = agora + ttl if expira_em is None else min(expira_em, agora + ttl)
+        entrada = (valor, expira_em, min(instantes, default=agora))
+        with lock:
+            entradas[chave] = entrada
+            entradas.move_to_end(chave)
+            while len(entradas) > MAX_ENTRADAS_MEMORIA:
+                entradas.popitem(last=False)
+            proxima_tentativa.pop(chave, None)
+        return entrada
+
+    def revalidar(chave, args, kwargs, ttl):
+        try:
+            with segundo_plano():
+                calcular(chave, args, kwargs, ttl)
+        except Exception:
+            logger.warning("Falha ao atualizar %s em segundo plano", funcao.__name__, exc_info=True)
+            with lock:
+                proxima_tentativa[chave] = time.time() + ESPERA_APOS_FALHA
+        finally:
+            with lock:
+                atualizando.discard(chave)
+
+    def servir(args, kwargs):
+        """(cópia do valor, origem): memoria, obsoleto, calculado ou antigo."""
+        argumentos = assinatura.bind(*args, **kwargs)
+        argumentos.apply_defaults()
+        chave = tuple(argumentos.arguments.items())
+        ttl = ttl_periodo(argumentos.arguments.get("end_date"))
+        agora = time.time()
+
+        with lock:
+            entrada = entradas.get(chave)
+            if entrada is not None:
+                valor, expira_em, obtido_em = entrada
+                fresca = expira_em is None or agora < expira_em
+                if fresca or agora - expira_em < JANELA_OBSOLETA:
+                    entradas.move_to_end(chave)
+                    disparar = (not fresca and chave not in atualizando
+                                and agora >= proxima_tentativa.get(chave, 0))
+                    if disparar:
+                        atualizando.add(chave)
+                    _anotar_obtido_em(obtido_em, expira_em)
+                    if disparar:
+                        threading.Thread(
+                            target=revalidar, args=(chave, args, kwargs, ttl),
+                            name=f"revalidar-{funcao.__name__}", daemon=True
+                        ).start()
+                    return copy.deepcopy(valor), "memoria" if fresca else "obsoleto"
+
+        origem = "calculado"
+        try:
+            valor, expira_em, obtido_em = calcular(chave, args, kwargs, ttl)
+        except Exception:
+            # Último valor bom, mesmo fora da janela, antes de deixar a falha subir
+            if entrada is None:
+                raise
+            logger.warning("Servindo valor antigo de %s após falha", funcao.__name__, exc_info=True)
+            valor, expira_em, obtido_em = entrada
+            origem = "antigo"
+        _anotar_obtido_em(obtido_em, expira_em)
+        return copy.deepcopy(valor), origem
+
+    @wraps(funcao)
+    def wrapper(*args, **kwargs):
+        with medir("fetch_segundos", funcao=funcao.__name__):
+            valor, origem = servir(args, kwargs)
+        contar("cache_memoria", funcao=funcao.__name__, resultado=origem)
+        return valor
+
+    def clear():
+        with lock:
+            entradas.clear()
+
+    wrapper.clear = clear
+    return wrapper
@@ -1,4 +1,52 @@
 # config.py
+import os
+
+# Propriedade GA4 compartilhada por todos os clientes
+PROPERTY_ID = os.getenv("GA4_PROPERTY_ID", "378239992")
+
+# Diretório do cache persistente de relatórios GA4 (compartilhado entre processos)
+CACHE_DIR = os.getenv("GA4_CACHE_DIR", ".cache_ga4")
+# Limites do cache em disco: arquivos mais antigos que CACHE_MAX_DIAS saem primeiro,
+# depois os mais antigos até o diretório caber em CACHE_MAX_MB
+CACHE_MAX_MB = int(os.getenv("GA4_CACHE_MAX_MB", "2048"))
+CACHE_MAX_DIAS = int(os.getenv("GA4_CACHE_MAX_DIAS", "90"))
+
+# Fuso horário da propriedade GA4: define o que é "hoje" para os atalhos e o cache
+GA4_FUSO_HORARIO = os.getenv("GA4_FUSO_HORARIO", "America/Sao_Paulo")
+
+# Origem dos dados do GA4: "real", "simulado" (sintético), "gravar" (real + grava
+# fixtures) ou "reproduzir" (fixtures gravadas, sintético no que faltar)
+GA4_MODO = os.getenv("GA4_MODO", "real")
+GA4_FIXTURES_DIR = os.getenv("GA4_FIXTURES_DIR", "fixtures_ga4")
+# Tamanho, latência média e taxa de falhas das respostas simuladas
+GA4_SIMULADO_LINHAS = int(os.getenv("GA4_SIMULADO_LINHAS", "500"))
+GA4_SIMULADO_LATENCIA_MS = float(os.getenv("GA4_SIMULADO_LATENCIA_MS", "0"))
+GA4_SIMULADO_TAXA_ERRO = float(os.getenv("GA4_SIMULADO_TAXA_ERRO", "0"))
+
+# Tokens do GA4 por hora que o app pode gastar na propriedade (cota padrão por projeto)
+GA4_TOKENS_POR_HORA = int(os.getenv("GA4_TOKENS_POR_HORA", "14000"))
+
+# Endpoint /metrics (formato Prometheus) do processo do app; porta 0 desliga
+METRICAS_PORTA = int(os.getenv("METRICAS_PORTA", "0"))
+METRICAS_ENDERECO = os.getenv("METRICAS_ENDERECO", "127.0.0.1")
+
+# Cache persistente das respostas da IA (SQLite fora de CACHE_DIR, cuja limpeza só
+# preserva relatórios): respostas mais velhas que IA_CACHE_MAX_DIAS expiram e, acima
+# de IA_CACHE_MAX_ENTRADAS, saem as usadas há mais tempo
+IA_CACHE_ARQUIVO = os.getenv("IA_CACHE_ARQUIVO", "respostas_ia.db")
+IA_CACHE_MAX_DIAS = int(os.getenv("IA_CACHE_MAX_DIAS", "7"))
+IA_CACHE_MAX_ENTRADAS = int(os.getenv("IA_CACHE_MAX_ENTRADAS", "2000"))
+
+# Pedidos paralelos à IA (desligado por padrão): se o primeiro token não chegar em
+# IA_PARALELO_APOS_S segundos, o prompt vai também para o próximo modelo, com até
+# IA_PARALELO_MAX pedidos extras abertos; vale a resposta que começar primeiro
+IA_PARALELO = os.getenv("IA_PARALELO", "0") == "1"
+IA_PARALELO_APOS_S = float(os.getenv("IA_PARALELO_APOS_S", "2"))
+IA_PARALELO_MAX = int(os.getenv("IA_PARALELO_MAX", "1"))
+
+# Tamanho máximo (tokens estimados) do prompt de diagnóstico; os resumos dos
+# relatórios são cortados para caber
+IA_PROMPT_MAX_TOKENS = int(os.getenv("IA_PROMPT_MAX_TOKENS", "1200"))
 
 nomes_amigaveis = {
     "alvorada": "Alvorada",
@@ -21,3 +69,37 @@ nomes_amigaveis = {
     "saoluis": "São Luís",
     "ferragensthony": "Ferragens Thony"
 }
+
+# Relatórios (fetch_*) que cada aba do app consome; o aquecedor_cache aquece a união
+RELATORIOS_POR_ABA = {
+    "📌 Resumo Executivo": [
+        "fetch_kpis_comparativo",
+        "fetch_canais_comparativo", "fetch_produtos_comparativo",
+        "fetch_regioes_mais_acessadas"
+    ],
+    "Vendas e Receita": [
+        "fetch_kpis_comparativo",
+        "fetch_funil_conversao", "fetch_receita_transacoes_por_dia"
+    ],
+    "Produtos e Categorias": [
+        "fetch_produtos_comparativo",
+        "fetch_produtos_abandonados", "fetch_categorias_mais_vendidas"
+    ],
+    "Canais de Aquisição": [
+        "fetch_canais_comparativo"
+    ],
+    "Engajamento e Regiões": [
+        "fetch_regioes_mais_acessadas", "fetch_engajamento_site"
+    ],
+    "Páginas e Carrinho": [
+        "fetch_paginas_mais_acessadas", "fetch_funil_abandono",
+        "fetch_produtos_abandonados"
+    ],
+    # Tudo o que coletar_dados_dashboard lê, inclusive produtos e categorias limitados
+    "📋 Diagnóstico IA": [
+        "coletar_dados_dashboard"
+    ],
+    "🏁 Ranking de Clientes": [
+        "fetch_ranking_clientes"
+    ]
+}
@@ -0,0 +1,187 @@
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from config import GA4_TOKENS_POR_HORA
+from metricas_utils import contar
+
+# === AGENDADOR DE COTA DO GA4 ===
+# O GA4 cobra tokens por propriedade e por hora, e todos os clientes usam a
+# mesma propriedade. Cada chamada passa por um balde de tokens da propriedade,
+# reabastecido continuamente até GA4_TOKENS_POR_HORA e corrigido pelo saldo
+# que o próprio GA4 devolve em property_quota. Sem cota, as chamadas esperam
+# numa fila: sessões interativas antes do segundo plano e, na mesma
+# prioridade, primeiro o cliente que menos consumiu na última hora.
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_SEGUNDO_PLANO = 1
+CUSTO_INICIAL = 10          # tokens estimados por relatório até haver medição
+RESERVA_INTERATIVA = 0.2    # fração do balde que o segundo plano não pode usar
+JANELA_CONSUMO = 3600       # segundos considerados no consumo por cliente
+ESPERA_MAXIMA = {PRIORIDADE_INTERATIVA: 60, PRIORIDADE_SEGUNDO_PLANO: None}
+# Saldos horários devolvidos pelo GA4; vale o menor deles
+CAMPOS_SALDO = ("tokens_per_hour", "tokens_per_project_per_hour")
+
+
+class CotaEsgotadaError(RuntimeError):
+    """A cota do GA4 não liberou a tempo para uma chamada interativa."""
+
+
+_contexto = threading.local()
+
+
+def prioridade_atual():
+    return getattr(_contexto, "prioridade", PRIORIDADE_INTERATIVA)
+
+
+@contextmanager
+def segundo_plano():
+    """Marca as chamadas ao GA4 feitas dentro do bloco como trabalho em segundo plano."""
+    anterior = prioridade_atual()
+    _contexto.prioridade = PRIORIDADE_SEGUNDO_PLANO
+    try:
+        yield
+    finally:
+        _contexto.prioridade = anterior
+
+
+class _Balde:
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.tokens = float(capacidade)
+        self.atualizado_em = time.monotonic()
+        self.custo_medio = float(CUSTO_INICIAL)
+        self.restante_ga4 = None
+
+    def reabastecer(self, agora):
+        ganho = (agora - self.atualizado_em) * self.capacidade / 3600
+        self.tokens = min(self.capacidade, self.tokens + ganho)
+        self.atualizado_em = agora
+
+
+class AgendadorCota:
+    def __init__(self, tokens_por_hora=GA4_TOKENS_POR_HORA):
+        self.tokens_por_hora = tokens_por_hora
+        self._cond = threading.Condition()
+        self._baldes = {}
+        self._fila = []
+        self._sequencia = itertools.count()
+        self._consumo = {}
+        self._estatisticas = {"chamadas": 0, "esperas": 0, "segundos_esperando": 0.0, "recusadas": 0}
+
+    def _balde(self, propriedade):
+        if propriedade not in self._baldes:
+            self._baldes[propriedade] = _Balde(self.tokens_por_hora)
+        return self._baldes[propriedade]
+
+    def _consumo_cliente(self, cliente, agora):
+        historico = self._consumo.get(cliente)
+        if not historico:
+            return 0
+        while historico and agora - historico[0][0] > JANELA_CONSUMO:
+            historico.popleft()
+        return sum(tokens for _, tokens in historico)
+
+    def _e_a_vez(self, vez, agora):
+        # Mesma propriedade: menor prioridade, depois menor consumo do cliente, depois ordem de chegada
+        concorrentes = [v for v in self._fila if v[1] == vez[1]]
+        primeiro = min(concorrentes, key=lambda v: (v[0], self._consumo_cliente(v[3], agora), v[2]))
+        return primeiro is vez
+
+    def reservar(self, propriedade, cliente, n_relatorios, prioridade=None):
+        """Bloqueia a thread chamadora até haver cota para n_relatorios; devolve o custo reservado.
+
+        Deve ser chamado na thread da sessão, antes de entregar a chamada ao
+        pool de lotes, para que a fila ordene as sessões e não os workers.
+        """
+        prioridade = prioridade_atual() if prioridade is None else prioridade
+        with self._cond:
+            balde = self._balde(propriedade)
+            reserva = balde.capacidade * RESERVA_INTERATIVA if prioridade == PRIORIDADE_SEGUNDO_PLANO else 0
+            custo = min(balde.custo_medio * n_relatorios, balde.capacidade - reserva)
+            vez = (prioridade, propriedade, next(self._sequencia), cliente)
+            self._fila.append(vez)
+            inicio = time.monotonic()
+            limite = ESPERA_MAXIMA[prioridade]
+            esperou = False
+            try:
+                while True:
+                    agora = time.monotonic()
+                    balde.reabastecer(agora)
+                    if self._e_a_vez(vez, agora) and balde.tokens - custo >= reserva:
+                        balde.tokens -= custo
+                        return custo
+                    if limite is not None and agora - inicio >= limite:
+                        self._estatisticas["recusadas"] += 1
+                        raise CotaEsgotadaError(
+                            f"Cota do GA4 esgotada para {propriedade}; tente novamente em alguns minutos."
+                        )
+                    esperou = True
+                    falta = max(custo + reserva - balde.tokens, 0) * 3600 / balde.capacidade
+                    if limite is not None:
+                        falta = min(falta, limite - (agora - inicio))
+                    self._cond.wait(timeout=max(falta, 0.05))
+            finally:
+                self._fila.remove(vez)
+                self._estatisticas["chamadas"] += 1
+                if esperou:
+                    self._estatisticas["esperas"] += 1
+                    self._estatisticas["segundos_esperando"] += time.monotonic() - inicio
+                self._cond.notify_all()
+
+    def registrar(self, propriedade, cliente, custo, respostas):
+        """Acerta o balde com o custo real das respostas (property_quota)."""
+        consumido = 0
+        restantes = []
+        medidas = 0
+        for resposta in respostas:
+            if "property_quota" not in resposta:
+                continue
+            cota = resposta.property_quota
+            consumido += cota.tokens_per_hour.consumed
+            restantes += [getattr(cota, campo).remaining for campo in CAMPOS_SALDO if campo in cota]
+            medidas += 1
+
+        with self._cond:
+            balde = self._balde(propriedade)
+            if medidas:
+                # Troca a estimativa pelo custo real e respeita o saldo informado pelo GA4
+                balde.tokens += custo - consumido
+                balde.custo_medio = 0.8 * balde.custo_medio + 0.2 * (consumido / medidas)
+                if restantes:
+                    balde.restante_ga4 = min(restantes)
+                    balde.tokens = min(balde.tokens, balde.restante_ga4)
+            else:
+                consumido = custo
+            self._consumo.setdefault(cliente, deque()).append((time.monotonic(), consumido))
+            self._cond.notify_all()
+        contar("ga4_tokens", consumido, cliente=cliente or "Todos")
+
+    def estatisticas(self):
+        with self._cond:
+            agora = time.monotonic()
+            for balde in self._baldes.values():
+                balde.reabastecer(agora)
+            return {
+                **self._estatisticas,
+                "na_fila": len(self._fila),
+                "propriedades": {
+                    propriedade: {
+                        "tokens_disponiveis": int(balde.tokens),
+                        "restante_ga4": balde.restante_ga4,
+                        "custo_medio": round(balde.custo_medio, 1)
+                    }
+                    for propriedade, balde in self._baldes.items()
+                },
+                "consumo_por_cliente": {
+                    cliente or "Todos": self._consumo_cliente(cliente, agora) for cliente in list(self._consumo)
+                }
+            }
+
+
+agendador = AgendadorCota()
+
+
+def estatisticas_cota():
+    """Saldo de tokens por propriedade, fila e consumo de cada cliente na última hora."""
+    return agendador.estatisticas()
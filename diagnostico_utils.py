@@ -1,12 +1,25 @@
 import os
 import json
+import time
+import queue
+import threading
 import tempfile
+from functools import partial
+import pandas as pd
+from contextlib import closing
 import streamlit as st
+from streamlit.errors import StreamlitSecretNotFoundError
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, NotFoundError, RateLimitError, APITimeoutError, APIConnectionError
 from docx import Document
+from config import IA_PARALELO, IA_PARALELO_APOS_S, IA_PARALELO_MAX, IA_PROMPT_MAX_TOKENS
+from cache_utils import cache_por_periodo
+from metricas_utils import registrar, contar
+from cache_ia_utils import chave_resposta, impressao_dados, ler_resposta, gravar_resposta
 from ga4_utils import (
-    fetch_ga4_kpis,
+    fetch_kpis_comparativo,
+    kpis_do_periodo,
+    PERIODOS_COMPARACAO,
     fetch_funil_conversao,
     fetch_produtos_mais_vendidos,
     fetch_categorias_mais_vendidas,
@@ -14,38 +27,77 @@ from ga4_utils import (
     fetch_regioes_mais_acessadas,
     fetch_engajamento_site,
     fetch_paginas_mais_acessadas,
-    fetch_conversoes_por_canal,
-    fetch_funil_abandono
+    fetch_canais_comparativo,
+    fetch_funil_abandono,
+    RELATORIOS,
+    _req_produtos_mais_vendidos,
+    _req_categorias_mais_vendidas
 )
 
 load_dotenv()
 
 # --- Cliente Groq com endpoint compatível OpenAI ---
-client = OpenAI(
-    api_key=st.secrets["GROQ_API_KEY"],
-    base_url="https://api.groq.com/openai/v1"
-)
+# Criado no primeiro uso: importar o módulo não exige o segredo GROQ_API_KEY
+_cliente_ia = None
+_lock_cliente_ia = threading.Lock()
+
+
+def get_cliente_ia():
+    global _cliente_ia
+    with _lock_cliente_ia:
+        if _cliente_ia is None:
+            _cliente_ia = OpenAI(
+                api_key=st.secrets["GROQ_API_KEY"],
+                base_url="https://api.groq.com/openai/v1"
+            )
+        return _cliente_ia
+
+
+class SemModeloIAError(RuntimeError):
+    """Não sobrou nenhum modelo de IA para tentar."""
+
+
+def _modelo_preferido():
+    """GROQ_MODEL do secrets, ou "" se não houver (nem secrets.toml, como no benchmark)."""
+    try:
+        return st.secrets.get("GROQ_MODEL", "").strip()
+    except StreamlitSecretNotFoundError:
+        return ""
 
 # ------------------------------
 # Utilidades de modelo (Groq)
 # ------------------------------
+# A listagem de /models vale por TTL_MODELOS segundos (TTL_MODELOS_FALHA se falhou)
+TTL_MODELOS = 3600
+TTL_MODELOS_FALHA = 300
+_modelos_listados = {"ids": [], "validade": 0.0}
+_lock_modelos = threading.Lock()
+
 def _listar_modelos_disponiveis():
     """Tenta listar modelos do provedor; retorna nomes (str)."""
-    try:
-        modelos = client.models.list()
-        return [m.id for m in getattr(modelos, "data", []) if hasattr(m, "id")]
-    except Exception:
-        # Sem permissão/listagem indisponível – segue com fallback estático
-        return []
+    with _lock_modelos:
+        if time.monotonic() < _modelos_listados["validade"]:
+            return _modelos_listados["ids"]
+        try:
+            modelos = get_cliente_ia().models.list()
+            ids = [m.id for m in getattr(modelos, "data", []) if hasattr(m, "id")]
+        except Exception:
+            # Sem permissão/listagem indisponível – segue com fallback estático
+            ids = []
+        _modelos_listados["ids"] = ids
+        _modelos_listados["validade"] = time.monotonic() + (TTL_MODELOS if ids else TTL_MODELOS_FALHA)
+        return ids
 
 def _sequencia_modelos():
     """
     Monta a sequência de tentativas de modelos:
     1) GROQ_MODEL do secrets (se existir)
     2) Modelos retornados por /models priorizando Llama recentes
-    3) Lista de candidatos estática (ampla)
+    3) Lista de candidatos estática (ampla), só com os que /models listou (se listou;
+       inteira se o filtro não deixar nenhum)
+    Por fim, saude_modelos põe os saudáveis mais rápidos na frente e os suspensos fora.
     """
-    preferido = st.secrets.get("GROQ_MODEL", "").strip()
+    preferido = _modelo_preferido()
     ordem = []
 
     if preferido:
@@ -84,8 +136,11 @@ def _sequencia_modelos():
         "llama3-8b-8192",
     ]
     for c in candidatos:
-        if c not in ordem:
+        if c not in ordem and (not ativos or c in ativos):
             ordem.append(c)
+    # /models listou só modelos fora das listas: tenta os candidatos assim mesmo
+    if not ordem:
+        ordem.extend(candidatos)
 
     # remove duplicados preservando ordem
     visto = set()
@@ -94,52 +149,316 @@ def _sequencia_modelos():
         if m and m not in visto:
             final.append(m)
             visto.add(m)
-    return final
+    return saude_modelos.ordenar(final, fixo=preferido)
+
+# ------------------------------
+# Saúde dos modelos
+# ------------------------------
+# Modelo que falha fica suspenso por um tempo que depende do motivo: desativado
+# (decommissioned/inexistente) por um dia, cota pelo Retry-After do provedor,
+# timeout/conexão por pouco tempo. Entre os saudáveis, vão na frente os de menor
+# tempo até o primeiro token observado.
+SUSPENSAO_MODELO = {"desativado": 24 * 3600, "cota": 300, "tempo": 60, "outro": 120}
+PESO_LATENCIA = 0.3  # média móvel exponencial do tempo até o primeiro token
+
+def _motivo_falha(e):
+    mensagem = _extrair_mensagem_erro(e).lower()
+    if isinstance(e, NotFoundError) or any(t in mensagem for t in ("decommissioned", "does not exist", "model_not_found")):
+        return "desativado"
+    if isinstance(e, RateLimitError):
+        return "cota"
+    if isinstance(e, (APITimeoutError, APIConnectionError)):
+        return "tempo"
+    return "outro"
+
+def _espera_pedida(e):
+    """Segundos do cabeçalho Retry-After da resposta de erro, se houver."""
+    resposta = getattr(e, "response", None)
+    try:
+        return float(resposta.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class SaudeModelos:
+    def __init__(self, suspensao=SUSPENSAO_MODELO):
+        self.suspensao = suspensao
+        self._lock = threading.Lock()
+        self._suspensos = {}   # modelo -> (até quando, motivo)
+        self._latencia = {}    # modelo -> segundos até o primeiro token (média móvel)
+
+    def falha(self, modelo, e):
+        motivo = _motivo_falha(e)
+        duracao = (_espera_pedida(e) if motivo == "cota" else None) or self.suspensao[motivo]
+        with self._lock:
+            self._suspensos[modelo] = (time.monotonic() + duracao, motivo)
+        contar("ia_modelo_suspenso", modelo=modelo, motivo=motivo)
+        return motivo
+
+    def primeiro_token(self, modelo, segundos):
+        with self._lock:
+            self._suspensos.pop(modelo, None)
+            anterior = self._latencia.get(modelo)
+            self._latencia[modelo] = segundos if anterior is None else (
+                PESO_LATENCIA * segundos + (1 - PESO_LATENCIA) * anterior)
+
+    def ordenar(self, modelos, fixo=None):
+        """Saudáveis primeiro (fixo, depois os de menor latência); suspensos só se não sobrar nenhum."""
+        agora = time.monotonic()
+        with self._lock:
+            suspensos = {m: ate for m, (ate, _) in self._suspensos.items() if ate > agora}
+            latencia = dict(self._latencia)
+        saudaveis = [m for m in modelos if m not in suspensos]
+        # sort é estável: quem não tem latência medida mantém a ordem de prioridade
+        saudaveis.sort(key=lambda m: (m != fixo, m not in latencia, latencia.get(m, 0)))
+        if saudaveis:
+            return saudaveis
+        return sorted(modelos, key=lambda m: suspensos[m])
+
+    def estatisticas(self):
+        agora = time.monotonic()
+        with self._lock:
+            modelos = set(self._suspensos) | set(self._latencia)
+            linhas = []
+            for m in sorted(modelos):
+                ate, motivo = self._suspensos.get(m, (0, None))
+                linhas.append({
+                    "modelo": m,
+                    "estado": motivo if ate > agora else "saudável",
+                    "suspenso_por_s": max(0, round(ate - agora)),
+                    "primeiro_token_s": round(self._latencia[m], 2) if m in self._latencia else None
+                })
+            return linhas
+
+saude_modelos = SaudeModelos()
+
+def estatisticas_modelos():
+    """Estado (saudável ou motivo da suspensão) e latência observada de cada modelo."""
+    return saude_modelos.estatisticas()
 
 # ------------------------------
 # Coleta de dados
 # ------------------------------
-@st.cache_data(ttl=3600)
+# Produtos e categorias levados ao diagnóstico (o prompt só usa o topo da lista)
+MAX_LINHAS_DIAGNOSTICO = 50
+# Itens de cada tabela que entram no prompt e corte do z robusto para "fora da curva"
+TOP_PROMPT = 5
+LIMITE_FORA_DA_CURVA = 3.5
+ROTULOS_KPIS = {
+    "receita_total": "Receita",
+    "vendas": "Vendas",
+    "taxa_conversao": "Taxa de conversão",
+    "ticket_medio": "Ticket médio"
+}
+
+
+def _variacao(novo, antigo):
+    return "n/d" if not antigo else f"{(novo - antigo) / antigo * 100:+.1f}%"
+
+def _parcela(valor, total):
+    return f"{valor / total * 100:.0f}%" if total else "n/d"
+
+def _fora_da_curva(serie, limite=LIMITE_FORA_DA_CURVA):
+    """Máscara dos valores longe da mediana (z robusto, pelo desvio absoluto mediano)."""
+    mediana = serie.median()
+    desvio = (serie - mediana).abs().median()
+    if not desvio:
+        return pd.Series(False, index=serie.index)
+    return (0.6745 * (serie - mediana) / desvio).abs() > limite
+
+def resumir_kpis(comparativo):
+    """Variação de cada KPI contra o período anterior e o ano anterior."""
+    atual, anterior, ano_anterior = (kpis_do_periodo(comparativo, p) for p in PERIODOS_COMPARACAO)
+    return [
+        f"{rotulo}: {_variacao(atual[chave], anterior[chave])} vs período anterior, "
+        f"{_variacao(atual[chave], ano_anterior[chave])} vs ano anterior"
+        for chave, rotulo in ROTULOS_KPIS.items()
+    ]
+
+def _resumir_funil(funil, abandono):
+    etapas = list(funil.values())
+    passagens = [_parcela(depois, antes) for antes, depois in zip(etapas, etapas[1:])]
+    return [
+        f"{funil['sessao']} sessões > {funil['carrinho']} carrinhos > {funil['checkout']} checkouts > {funil['compra']} compras",
+        f"Passagem entre etapas: sessão→carrinho {passagens[0]}, carrinho→checkout {passagens[1]}, checkout→compra {passagens[2]}",
+        f"Abandono: carrinho {max(abandono['taxa_abandono_carrinho'], 0):.1f}%, checkout {max(abandono['taxa_abandono_checkout'], 0):.1f}%"
+    ]
+
+def _resumir_canais(canais):
+    atual = canais[canais["Período"] == "atual"]
+    anterior = canais[canais["Período"] == "anterior"].set_index("Canal")["Receita (R$)"]
+    total = atual["Receita (R$)"].sum()
+    linhas = [
+        f"{c['Canal']}: R$ {c['Receita (R$)']:,.2f} ({_parcela(c['Receita (R$)'], total)} da receita), "
+        f"conversão {c['Taxa de Conversão (%)']:.2f}%, receita {_variacao(c['Receita (R$)'], anterior.get(c['Canal']))} vs período anterior"
+        for _, c in atual.head(TOP_PROMPT).iterrows()
+    ]
+    fora = atual[_fora_da_curva(atual["Taxa de Conversão (%)"]) & (atual["Sessões"] >= atual["Sessões"].median())]
+    linhas += [
+        f"Conversão fora da curva: {c['Canal']} com {c['Taxa de Conversão (%)']:.2f}% "
+        f"(mediana dos canais {atual['Taxa de Conversão (%)'].median():.2f}%)"
+        for _, c in fora.iterrows()
+    ]
+    return linhas
+
+def _resumir_produtos(produtos):
+    total = produtos["Receita (R$)"].sum()
+    linhas = [f"Os {min(3, len(produtos))} primeiros somam {_parcela(produtos['Receita (R$)'].head(3).sum(), total)} da receita de produtos"]
+    linhas += [
+        f"{p['Produto']}: R$ {p['Receita (R$)']:,.2f} ({_parcela(p['Receita (R$)'], total)}), {p['Quantidade Vendida']:.0f} un."
+        for _, p in produtos.head(TOP_PROMPT).iterrows()
+    ]
+    fora = produtos[_fora_da_curva(produtos["Ticket Médio (R$)"])]
+    linhas += [
+        f"Ticket fora da curva: {p['Produto']} com R$ {p['Ticket Médio (R$)']:,.2f} "
+        f"(mediana R$ {produtos['Ticket Médio (R$)'].median():,.2f})"
+        for _, p in fora.head(TOP_PROMPT).iterrows()
+    ]
+    return linhas
+
+def _resumir_categorias(categorias):
+    total = categorias["Receita (R$)"].sum()
+    return [
+        f"{c['Categoria']}: R$ {c['Receita (R$)']:,.2f} ({_parcela(c['Receita (R$)'], total)})"
+        for _, c in categorias.head(TOP_PROMPT).iterrows()
+    ]
+
+def _resumir_paginas(paginas):
+    linhas = [
+        f"{p['Página']}: {p['Visualizações']:.0f} visualizações, engajamento {p['Taxa de Engajamento (%)']:.0f}%"
+        for _, p in paginas.head(TOP_PROMPT).iterrows()
+    ]
+    mediana = paginas["Taxa de Engajamento (%)"].median()
+    fora = paginas[_fora_da_curva(paginas["Taxa de Engajamento (%)"])
+                   & (paginas["Visualizações"] >= paginas["Visualizações"].median())]
+    linhas += [
+        f"Engajamento fora da curva: {p['Página']} com {p['Taxa de Engajamento (%)']:.0f}% (mediana {mediana:.0f}%)"
+        for _, p in fora.head(TOP_PROMPT).iterrows()
+    ]
+    return linhas
+
+def _resumir_engajamento(engajamento):
+    sessoes = engajamento["Acessos Totais"]
+    metade = len(engajamento) // 2
+    linhas = [
+        f"{sessoes.sum():.0f} sessões, média de {sessoes.mean():.0f} por dia; "
+        f"engajamento médio {engajamento['Taxa de Engajamento (%)'].mean():.0f}%"
+    ]
+    if metade:
+        linhas.append(f"Sessões na segunda metade do período: {_variacao(sessoes.iloc[metade:].sum(), sessoes.iloc[:metade].sum())} vs primeira metade")
+    fora = engajamento[_fora_da_curva(sessoes)]
+    linhas += [
+        f"Dia fora da curva: {d['Data']} com {d['Acessos Totais']:.0f} sessões (mediana {sessoes.median():.0f})"
+        for _, d in fora.head(TOP_PROMPT).iterrows()
+    ]
+    return linhas
+
+def _resumir_parcelas(df, rotulo, valor):
+    total = df[valor].sum()
+    return [f"{linha[rotulo]}: {linha[valor]:.0f} ({_parcela(linha[valor], total)})" for _, linha in df.head(TOP_PROMPT).iterrows()]
+
+
+# Requisições que coletar_dados_dashboard faz, para a aba pré-carregá-las num só
+# lote. Produtos e categorias vão com o limite do diagnóstico, que muda a chave
+# de cache em relação aos fetch_* sem limite.
+RELATORIOS["coletar_dados_dashboard"] = [
+    construir
+    for nome in ["fetch_kpis_comparativo", "fetch_funil_conversao", "fetch_tecnologia_usuarios",
+                 "fetch_regioes_mais_acessadas", "fetch_engajamento_site", "fetch_paginas_mais_acessadas",
+                 "fetch_canais_comparativo", "fetch_funil_abandono"]
+    for construir in RELATORIOS[nome]
+] + [
+    partial(_req_produtos_mais_vendidos, max_linhas=MAX_LINHAS_DIAGNOSTICO),
+    partial(_req_categorias_mais_vendidas, max_linhas=MAX_LINHAS_DIAGNOSTICO)
+]
+
+
+@cache_por_periodo
 def coletar_dados_dashboard(property_id, start_date, end_date, customer_root):
-    kpis = fetch_ga4_kpis(property_id, start_date, end_date, customer_root)
+    """
+    KPIs, funil e destaques do período, mais resumos estatísticos (top-k, variações
+    e valores fora da curva) de cada relatório, já em linhas de texto por seção, na
+    ordem de importância para o prompt.
+    """
+    comparativo = fetch_kpis_comparativo(property_id, start_date, end_date, customer_root)
+    kpis = kpis_do_periodo(comparativo, "atual")
     funil = fetch_funil_conversao(property_id, start_date, end_date, customer_root)
-    produtos = fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root)
-    categorias = fetch_categorias_mais_vendidas(property_id, start_date, end_date, customer_root)
+    produtos = fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root, MAX_LINHAS_DIAGNOSTICO)
+    categorias = fetch_categorias_mais_vendidas(property_id, start_date, end_date, customer_root, MAX_LINHAS_DIAGNOSTICO)
     df_disp, _ = fetch_tecnologia_usuarios(property_id, start_date, end_date, customer_root)
     regioes = fetch_regioes_mais_acessadas(property_id, start_date, end_date, customer_root)
     engajamento = fetch_engajamento_site(property_id, start_date, end_date, customer_root)
     paginas = fetch_paginas_mais_acessadas(property_id, start_date, end_date, customer_root)
-    canais = fetch_conversoes_por_canal(property_id, start_date, end_date, customer_root)
+    canais = fetch_canais_comparativo(property_id, start_date, end_date, customer_root)
     abandono = fetch_funil_abandono(property_id, start_date, end_date, customer_root)
+    canais_atual = canais[canais["Período"] == "atual"]
+
+    resumos = {"Variação dos KPIs": resumir_kpis(comparativo), "Funil": _resumir_funil(funil, abandono)}
+    for titulo, df, resumir in [
+        ("Canais", canais_atual, lambda _: _resumir_canais(canais)),
+        ("Produtos", produtos, _resumir_produtos),
+        ("Categorias", categorias, _resumir_categorias),
+        ("Páginas", paginas, _resumir_paginas),
+        ("Engajamento diário", engajamento, _resumir_engajamento),
+        ("Cidades", regioes, lambda df: _resumir_parcelas(df, "Cidade", "Acessos")),
+        ("Dispositivos", df_disp, lambda df: _resumir_parcelas(df.sort_values("Sessões", ascending=False), "Categoria", "Sessões"))
+    ]:
+        if not df.empty:
+            resumos[titulo] = resumir(df)
 
     return {
         "kpis": kpis,
         "funil": funil,
-        "produtos": produtos.to_dict(orient="records") if not produtos.empty else [],
-        "categorias": categorias.to_dict(orient="records") if not categorias.empty else [],
-        "dispositivo_destaque": df_disp.sort_values("Sessões", ascending=False).iloc[0]["Categoria"] if not df_disp.empty else "n/d",
-        "cidade_top": regioes.sort_values("Acessos", ascending=False).iloc[0]["Cidade"] if not regioes.empty else "n/d",
-        "engajamento": engajamento.iloc[-1]["Taxa de Engajamento (%)"] if not engajamento.empty else 0,
-        "sessões_totais": int(engajamento["Acessos Totais"].sum()) if not engajamento.empty else 0,
-        "paginas_top": paginas["Página"].head(3).tolist() if not paginas.empty else [],
-        "paginas": paginas.to_dict(orient="records") if not paginas.empty else [],
-        "canais": canais.to_dict(orient="records") if not canais.empty else [],
         "abandono": abandono,
-        "periodo": f"{start_date} a {end_date}",
-        "ponto_forte": max(produtos.to_dict(orient="records"), key=lambda x: x.get("Receita (R$)", 0), default=None) if not produtos.empty else None,
-        "tendencia_negativa": "Conversão abaixo de 0.5%" if kpis.get("taxa_conversao", 1) < 0.005 else ""
+        "destaques": {
+            "canal": canais_atual.iloc[0]["Canal"] if not canais_atual.empty else "N/D",
+            "produto": produtos.iloc[0]["Produto"] if not produtos.empty else "N/D",
+            "regiao": regioes.iloc[0]["Cidade"] if not regioes.empty else "N/D"
+        },
+        "resumos": resumos,
+        "periodo": f"{start_date} a {end_date}"
     }
 
 # ------------------------------
 # Prompt
 # ------------------------------
-def gerar_prompt(dados, cliente, inicio, fim):
+CARACTERES_POR_TOKEN = 4  # estimativa grosseira para português
+
+def estimar_tokens(texto):
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
+def _encaixar_resumos(resumos, orcamento):
+    """
+    Seções de resumos que cabem em orcamento caracteres. Uma linha de cada seção
+    por rodada (a primeira de todas, depois a segunda...), para o corte levar os
+    detalhes e não seções inteiras; a seção que não couber para de crescer.
+    """
+    escolhidas = {titulo: [] for titulo in resumos}
+    abertas = set(resumos)
+    restante = orcamento
+    for rodada in range(max((len(linhas) for linhas in resumos.values()), default=0)):
+        for titulo, linhas in resumos.items():
+            if titulo not in abertas or rodada >= len(linhas):
+                continue
+            custo = len(linhas[rodada]) + 3 + (len(titulo) + 8 if rodada == 0 else 0)
+            if custo > restante:
+                abertas.discard(titulo)
+                continue
+            escolhidas[titulo].append(linhas[rodada])
+            restante -= custo
+    return "".join(
+        f"\n**{titulo}**\n" + "".join(f"- {linha}\n" for linha in linhas)
+        for titulo, linhas in escolhidas.items() if linhas
+    )
+
+def gerar_prompt(dados, cliente, inicio, fim, max_tokens=IA_PROMPT_MAX_TOKENS):
+    """
+    Prompt com KPIs, destaques e os resumos de dados["resumos"] que couberem em
+    max_tokens (estimados por CARACTERES_POR_TOKEN).
+    """
     kpis = dados["kpis"]
-    canal = dados.get("top_canal", "N/D")
-    produto = dados.get("top_produto", "N/D")
-    regiao = dados.get("top_regiao", "N/D")
+    destaques = dados.get("destaques", {})
 
-    return f"""
+    cabecalho = f"""
 Você é um analista sênior de Web Analytics especializado em e-commerce.
 
 Abaixo estão os dados do cliente **{cliente}**, no período de **{inicio} a {fim}**:
@@ -152,10 +471,11 @@ Abaixo estão os dados do cliente **{cliente}**, no período de **{inicio} a {fi
 - Ticket Médio: R$ {kpis['ticket_medio']:,.2f}
 
 🏆 **Destaques**
-- Canal com maior receita: {canal}
-- Produto mais vendido: {produto}
-- Região com mais acessos: {regiao}
-
+- Canal com maior receita: {destaques.get('canal', 'N/D')}
+- Produto mais vendido: {destaques.get('produto', 'N/D')}
+- Região com mais acessos: {destaques.get('regiao', 'N/D')}
+"""
+    instrucoes = """
 ---
 🎯 **Instruções para você (IA):**
 1. Analise os dados e destaque **pontos de atenção** e **boas oportunidades**.
@@ -166,6 +486,8 @@ Abaixo estão os dados do cliente **{cliente}**, no período de **{inicio} a {fi
 
 Escreva como um consultor de performance digital falando com um gestor de e-commerce.
 """
+    orcamento = max_tokens * CARACTERES_POR_TOKEN - len(cabecalho) - len(instrucoes)
+    return cabecalho + _encaixar_resumos(dados.get("resumos", {}), orcamento) + instrucoes
 
 # ------------------------------
 # Chamada à IA (com auto-descoberta e fallbacks)
@@ -185,32 +507,211 @@ def _extrair_mensagem_erro(e: Exception) -> str:
     except Exception:
         return str(e)
 
-def chamar_ia(prompt: str) -> str:
-    modelos = _sequencia_modelos()
-    ultima_excecao = None
+def _modelo_pedido():
+    """Modelo que entra na chave do cache: o GROQ_MODEL ou a escolha automática."""
+    return _modelo_preferido() or "automatico"
+
+def resposta_guardada(prompt: str, dados=None):
+    """Resposta já guardada no cache para este prompt e estes dados, sem chamar a IA."""
+    guardada = ler_resposta(chave_resposta(_modelo_pedido(), prompt, impressao_dados(dados)))
+    contar("cache_ia", resultado="acerto" if guardada is not None else "falta")
+    return guardada
+
+def _registrar_falha(modelo, e):
+    contar("ia_segundos_erros", modelo=modelo)
+    saude_modelos.falha(modelo, e)
 
+def _avisar_falha(modelo, e):
+    _registrar_falha(modelo, e)
+    st.warning(f"Falha ao chamar o modelo '{modelo}'. Tentando o próximo…")
+    # Mensagem do provedor (útil p/ saber se foi 'decommissioned', quota, etc.)
+    st.caption("Detalhes (dev):")
+    st.code(_extrair_mensagem_erro(e))
+
+def _primeiro_token(modelo, segundos):
+    registrar("ia_primeiro_token_segundos", segundos, modelo=modelo)
+    saude_modelos.primeiro_token(modelo, segundos)
+
+def _abrir_fluxo(modelo, prompt):
+    return get_cliente_ia().chat.completions.create(
+        model=modelo,
+        messages=[
+            {"role": "system", "content": "Você é um analista de dados Web Analytics consultivo e especialista em e-commerce."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=900,  # ajustável conforme necessidade
+        stream=True
+    )
+
+def _textos(fluxo):
+    for evento in fluxo:
+        texto = evento.choices[0].delta.content if evento.choices else None
+        if texto:
+            yield texto
+
+def _transmitir_em_sequencia(modelos, prompt):
+    """(modelo, pedaço) do primeiro modelo que responder, tentando um de cada vez."""
+    ultima_excecao = None
     for modelo in modelos:
+        inicio = time.perf_counter()
         try:
-            resp = client.chat.completions.create(
-                model=modelo,
-                messages=[
-                    {"role": "system", "content": "Você é um analista de dados Web Analytics consultivo e especialista em e-commerce."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=900  # ajustável conforme necessidade
-            )
-            return resp.choices[0].message.content
+            fluxo = _abrir_fluxo(modelo, prompt)
         except Exception as e:
             ultima_excecao = e
-            import traceback
-            st.warning(f"Falha ao chamar o modelo '{modelo}'. Tentando o próximo…")
-            # Mensagem do provedor (útil p/ saber se foi 'decommissioned', quota, etc.)
-            st.caption("Detalhes (dev):")
-            st.code(_extrair_mensagem_erro(e))
+            _avisar_falha(modelo, e)
+            continue
+
+        recebeu = False
+        try:
+            for texto in _textos(fluxo):
+                if not recebeu:
+                    recebeu = True
+                    _primeiro_token(modelo, time.perf_counter() - inicio)
+                yield modelo, texto
+        except Exception as e:
+            if recebeu:
+                # Parte da resposta já foi exibida: não dá para emendar a de outro modelo
+                _registrar_falha(modelo, e)
+                raise
+            ultima_excecao = e
+            _avisar_falha(modelo, e)
+            continue
+        finally:
+            fluxo.close()
+        return
 
     # Se todos os modelos falharem, levanta o último erro para o Streamlit capturar
-    raise ultima_excecao
+    raise ultima_excecao or SemModeloIAError("Nenhum modelo de IA disponível.")
+
+class _Tentativa:
+    """Um pedido transmitido numa thread; os pedaços vão para a fila como (tentativa, texto, erro)."""
+
+    def __init__(self, modelo, prompt, fila):
+        self.modelo = modelo
+        self.inicio = time.perf_counter()
+        self.fluxo = None
+        self.cancelada = threading.Event()
+        threading.Thread(target=self._transmitir, args=(prompt, fila), name=f"ia-{modelo}", daemon=True).start()
+
+    def _transmitir(self, prompt, fila):
+        try:
+            self.fluxo = _abrir_fluxo(self.modelo, prompt)
+            for texto in _textos(self.fluxo):
+                if self.cancelada.is_set():
+                    return
+                fila.put((self, texto, None))
+            fila.put((self, None, None))
+        except Exception as e:
+            if not self.cancelada.is_set():
+                fila.put((self, None, e))
+        finally:
+            if self.fluxo is not None:
+                self.fluxo.close()
+
+    def cancelar(self):
+        self.cancelada.set()
+        fluxo = self.fluxo
+        if fluxo is not None:
+            try:
+                fluxo.close()  # destrava a thread parada esperando o próximo pedaço
+            except Exception:
+                pass
+
+def _transmitir_em_paralelo(modelos, prompt, apos_s=IA_PARALELO_APOS_S, max_paralelos=IA_PARALELO_MAX):
+    """
+    (modelo, pedaço) do modelo que responder primeiro. Se o primeiro pedaço não
+    chegar em apos_s segundos, o mesmo prompt vai também para o próximo modelo, até
+    max_paralelos pedidos extras ao mesmo tempo; o primeiro a escrever vence e os
+    outros são cancelados. Uma falha abre logo o pedido do modelo seguinte.
+    """
+    fila = queue.Queue()
+    pendentes = list(modelos)
+    ativas = [_Tentativa(pendentes.pop(0), prompt, fila)]
+    vencedora = None
+    ultima_excecao = None
+    try:
+        while ativas:
+            pode_abrir = vencedora is None and pendentes and len(ativas) <= max_paralelos
+            try:
+                tentativa, texto, erro = fila.get(timeout=apos_s if pode_abrir else None)
+            except queue.Empty:
+                contar("ia_pedidos_paralelos", modelo=pendentes[0])
+                ativas.append(_Tentativa(pendentes.pop(0), prompt, fila))
+                continue
+            if tentativa not in ativas:
+                continue  # resto de uma tentativa já cancelada
+            if erro is not None:
+                ativas.remove(tentativa)
+                if vencedora is not None:
+                    _registrar_falha(tentativa.modelo, erro)
+                    raise erro
+                ultima_excecao = erro
+                _avisar_falha(tentativa.modelo, erro)
+                if pendentes and len(ativas) <= max_paralelos:
+                    ativas.append(_Tentativa(pendentes.pop(0), prompt, fila))
+                continue
+            if vencedora is None:
+                vencedora = tentativa
+                _primeiro_token(tentativa.modelo, time.perf_counter() - tentativa.inicio)
+                for outra in ativas:
+                    if outra is not tentativa:
+                        # Perdeu a corrida: leva pelo menos esse tempo até o primeiro token
+                        saude_modelos.primeiro_token(outra.modelo, time.perf_counter() - outra.inicio)
+                        outra.cancelar()
+                ativas = [tentativa]
+            if texto is None:
+                return
+            yield tentativa.modelo, texto
+    finally:
+        # Fim, erro ou quem consome parou de ler (cancelamento): nenhum pedido fica aberto
+        for tentativa in ativas:
+            tentativa.cancelar()
+
+    raise ultima_excecao or SemModeloIAError("Nenhum modelo de IA disponível.")
+
+def transmitir_ia(prompt: str, dados=None, escopo=None):
+    """
+    Gera a resposta em pedaços, à medida que o modelo escreve (para st.write_stream).
+    dados: o que gerou o prompt (ex.: coletar_dados_dashboard), entra na chave do cache.
+    escopo: identifica relatório/cliente/período; uma resposta nova com outros dados
+    invalida as antigas do mesmo escopo.
+    Troca de modelo só se a falha vier antes do primeiro pedaço (com IA_PARALELO,
+    pedidos em paralelo a partir de IA_PARALELO_APOS_S). Se quem consome parar de
+    ler (o usuário cancelou e o Streamlit reexecutou o script), as conexões são
+    fechadas e a resposta parcial não vai para o cache.
+    """
+    impressao = impressao_dados(dados)
+    chave = chave_resposta(_modelo_pedido(), prompt, impressao)
+    guardada = ler_resposta(chave)
+    contar("cache_ia", resultado="acerto" if guardada is not None else "falta")
+    if guardada is not None:
+        yield guardada
+        return
+
+    registrar("ia_prompt_tokens", estimar_tokens(prompt))
+    modelos = _sequencia_modelos()
+    if not modelos:
+        raise SemModeloIAError("Nenhum modelo de IA disponível.")
+    if IA_PARALELO and len(modelos) > 1:
+        fonte = _transmitir_em_paralelo(modelos, prompt)
+    else:
+        fonte = _transmitir_em_sequencia(modelos, prompt)
+
+    inicio = time.perf_counter()
+    pedacos = []
+    with closing(fonte):
+        for modelo, texto in fonte:
+            pedacos.append(texto)
+            yield texto
+
+    if pedacos:
+        registrar("ia_segundos", time.perf_counter() - inicio, modelo=modelo)
+        gravar_resposta(chave, "".join(pedacos), modelo, impressao, escopo)
+
+def chamar_ia(prompt: str, dados=None, escopo=None) -> str:
+    """Resposta completa de uma vez (mesmo cache e fallbacks de transmitir_ia)."""
+    return "".join(transmitir_ia(prompt, dados, escopo))
 
 # ------------------------------
 # Exportadores
@@ -0,0 +1,319 @@
+"""Substituto local do BetaAnalyticsDataClient para rodar o app e os fetch_* sem GA4.
+
+Escolhido por GA4_MODO (config.py):
+    real        cliente de verdade (padrão)
+    simulado    respostas sintéticas, determinísticas por requisição
+    gravar      cliente de verdade, gravando cada resposta em GA4_FIXTURES_DIR
+    reproduzir  respostas gravadas; o que não foi gravado vira sintético
+
+Nos modos simulado e reproduzir, GA4_SIMULADO_LINHAS define quantas linhas os
+relatórios com dimensões devolvem, GA4_SIMULADO_LATENCIA_MS a latência média de
+cada chamada e GA4_SIMULADO_TAXA_ERRO a fração de chamadas que falham com
+ServiceUnavailable.
+"""
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from google.api_core import exceptions
+from google.analytics.data_v1beta.types import (
+    RunReportRequest, RunReportResponse, BatchRunReportsResponse,
+    RunRealtimeReportRequest, RunRealtimeReportResponse,
+    DimensionHeader, MetricHeader, DimensionValue, MetricValue, Row,
+    PropertyQuota, QuotaStatus, MetricType
+)
+from config import (
+    nomes_amigaveis, GA4_TOKENS_POR_HORA, GA4_FIXTURES_DIR,
+    GA4_SIMULADO_LINHAS, GA4_SIMULADO_LATENCIA_MS, GA4_SIMULADO_TAXA_ERRO
+)
+
+logger = logging.getLogger(__name__)
+
+# Eventos em ordem de funil: cada um acontece menos que o anterior
+EVENTOS = ["session_start", "page_view", "view_item", "add_to_cart", "begin_checkout", "purchase"]
+VALORES_DIMENSAO = {
+    "customUser:customer_root": list(nomes_amigaveis) + ["(not set)"],
+    "eventName": EVENTOS,
+    "deviceCategory": ["mobile", "desktop", "tablet"],
+    "operatingSystem": ["Android", "iOS", "Windows", "Macintosh", "Linux", "(not set)"],
+    "sessionDefaultChannelGroup": ["Organic Search", "Direct", "Paid Search", "Organic Social",
+                                   "Paid Social", "Email", "Referral", "Unassigned"],
+    "sessionSourceMedium": ["google / organic", "(direct) / (none)", "google / cpc",
+                            "instagram / social", "facebook / cpc", "newsletter / email"],
+    "region": ["Sao Paulo", "Goias", "Minas Gerais", "Para", "Parana", "Bahia", "(not set)"],
+}
+CUSTO_BASE_TOKENS = 5
+# Respostas sintéticas memorizadas por cliente (gerar 100 mil linhas leva segundos)
+MAX_MEMORIZADAS = 256
+
+
+def _tipo_metrica(nome):
+    if "Revenue" in nome or "Value" in nome:
+        return MetricType.TYPE_CURRENCY
+    if "Duration" in nome:
+        return MetricType.TYPE_SECONDS
+    if "Rate" in nome or "Per" in nome or nome == "conversions":
+        return MetricType.TYPE_FLOAT
+    return MetricType.TYPE_INTEGER
+
+
+def _valor_metrica(nome, tipo, rnd, peso):
+    if "Rate" in nome:
+        return f"{rnd.uniform(0.01, 0.9):.6f}"
+    if tipo == MetricType.TYPE_CURRENCY:
+        return f"{rnd.uniform(10, 5000) * peso:.2f}"
+    if tipo in (MetricType.TYPE_FLOAT, MetricType.TYPE_SECONDS):
+        return f"{rnd.uniform(1, 500) * peso:.2f}"
+    return str(max(int(rnd.uniform(1, 1000) * peso), 1))
+
+
+def _valores_filtrados(expressao, valores=None):
+    """Valores exigidos por filtros de igualdade/lista (and_group e filter), por dimensão."""
+    valores = {} if valores is None else valores
+    if "and_group" in expressao:
+        for filho in expressao.and_group.expressions:
+            _valores_filtrados(filho, valores)
+    elif "filter" in expressao:
+        filtro = expressao.filter
+        if "string_filter" in filtro:
+            valores[filtro.field_name] = [filtro.string_filter.value]
+        elif "in_list_filter" in filtro:
+            valores[filtro.field_name] = list(filtro.in_list_filter.values)
+    return valores
+
+
+def _serializar(request, *ignorados):
+    """Bytes da requisição sem os campos ignorados (o construtor do proto-plus não zera campos)."""
+    pb = type(request).pb(request)
+    copia = type(pb)()
+    copia.CopyFrom(pb)
+    for campo in ignorados:
+        if campo in copia.DESCRIPTOR.fields_by_name:
+            copia.ClearField(campo)
+    return copia.SerializeToString(deterministic=True)
+
+
+def _dias(inicio, fim, hoje):
+    def resolver(texto):
+        if texto == "today":
+            return hoje
+        if texto == "yesterday":
+            return hoje - timedelta(days=1)
+        if texto.endswith("daysAgo"):
+            return hoje - timedelta(days=int(texto[:-7]))
+        return date.fromisoformat(texto)
+    a, b = resolver(inicio), resolver(fim)
+    return [(a + timedelta(days=n)).strftime("%Y%m%d") for n in range((b - a).days + 1)]
+
+
+class ClienteGA4Simulado:
+    """Mesma interface do BetaAnalyticsDataClient usada pelo app, sem rede."""
+
+    def __init__(self, linhas=GA4_SIMULADO_LINHAS, latencia_ms=GA4_SIMULADO_LATENCIA_MS,
+                 taxa_erro=GA4_SIMULADO_TAXA_ERRO, fixtures=None, tokens_por_hora=GA4_TOKENS_POR_HORA):
+        self.linhas = linhas
+        self.latencia_ms = latencia_ms
+        self.taxa_erro = taxa_erro
+        self.fixtures = fixtures
+        self.tokens_por_hora = tokens_por_hora
+        self._lock = threading.Lock()
+        self._hora = None
+        self._consumido = 0
+        self._memorizadas = OrderedDict()
+        self.estatisticas = {"chamadas": 0, "relatorios": 0, "fixtures": 0, "sinteticos": 0, "erros_injetados": 0}
+
+    # --- Interface do cliente ---
+    def run_report(self, request=None, timeout=None, retry=None, **kwargs):
+        self._simular_rede(timeout)
+        return self._relatorio(RunReportRequest(request))
+
+    def batch_run_reports(self, request=None, timeout=None, retry=None, **kwargs):
+        self._simular_rede(timeout)
+        return BatchRunReportsResponse(reports=[self._relatorio(r) for r in request.requests])
+
+    def run_realtime_report(self, request=None, timeout=None, retry=None, **kwargs):
+        self._simular_rede(timeout)
+        request = RunRealtimeReportRequest(request)
+        resposta = self._de_fixture("run_realtime_report", request)
+        if resposta is None:
+            resposta = self._sintetizar(request, RunRealtimeReportResponse, [None])
+        return self._com_cota(request, resposta)
+
+    # --- Rede ---
+    def _simular_rede(self, timeout):
+        with self._lock:
+            self.estatisticas["chamadas"] += 1
+        if self.latencia_ms:
+            espera = random.uniform(0.5, 1.5) * self.latencia_ms / 1000
+            if timeout is not None and espera > timeout:
+                time.sleep(timeout)
+                raise exceptions.DeadlineExceeded("GA4 simulado: prazo da chamada esgotado")
+            time.sleep(espera)
+        if self.taxa_erro and random.random() < self.taxa_erro:
+            with self._lock:
+                self.estatisticas["erros_injetados"] += 1
+            raise exceptions.ServiceUnavailable("GA4 simulado: falha injetada")
+
+    # --- Relatórios ---
+    def _relatorio(self, request):
+        with self._lock:
+            self.estatisticas["relatorios"] += 1
+        resposta = self._de_fixture("run_report", request)
+        if resposta is None:
+            chave = _serializar(request, "return_property_quota")
+            with self._lock:
+                resposta = self._memorizadas.get(chave)
+                if resposta is not None:
+                    self._memorizadas.move_to_end(chave)
+            if resposta is None:
+                resposta = self._sintetizar(request, RunReportResponse, list(request.date_ranges))
+                with self._lock:
+                    self._memorizadas[chave] = resposta
+                    if len(self._memorizadas) > MAX_MEMORIZADAS:
+                        self._memorizadas.popitem(last=False)
+        return self._com_cota(request, resposta)
+
+    def _de_fixture(self, metodo, request):
+        if not self.fixtures:
+            return None
+        caminho = caminho_fixture(self.fixtures, metodo, request)
+        if not os.path.exists(caminho):
+            logger.debug("Sem fixture para %s; usando resposta sintética", caminho)
+            return None
+        tipo = RunRealtimeReportResponse if metodo == "run_realtime_report" else RunReportResponse
+        with open(caminho, "rb") as arquivo:
+            resposta = tipo.deserialize(arquivo.read())
+        with self._lock:
+            self.estatisticas["fixtures"] += 1
+        return resposta
+
+    def _sintetizar(self, request, tipo_resposta, intervalos):
+        with self._lock:
+            self.estatisticas["sinteticos"] += 1
+        # Mesma requisição (sem paginação) → mesmos dados, em qualquer página
+        semente = hashlib.sha256(_serializar(request, "offset", "limit", "return_property_quota")).hexdigest()
+        rnd = random.Random(semente)
+
+        dimensoes = [d.name for d in request.dimensions]
+        metricas = [m.name for m in request.metrics]
+        tipos = [_tipo_metrica(m) for m in metricas]
+        filtrados = _valores_filtrados(request.dimension_filter) if "dimension_filter" in request else {}
+        hoje = date.today()
+        varios = len(intervalos) > 1
+
+        linhas = []
+        for k, intervalo in enumerate(intervalos):
+            dias = _dias(intervalo.start_date, intervalo.end_date, hoje) if intervalo is not None else None
+            opcoes = []
+            for nome in dimensoes:
+                if nome == "date" and dias:
+                    opcoes.append(dias)
+                elif nome == "minutesAgo":
+                    opcoes.append([f"{m:02d}" for m in range(30)])
+                else:
+                    opcoes.append(filtrados.get(nome) or VALORES_DIMENSAO.get(nome))
+            # Produto cartesiano das dimensões (a primeira varia mais rápido),
+            # limitado a self.linhas; dimensões sem lista de valores são abertas
+            total = 1
+            for valores in opcoes:
+                total *= len(valores) if valores else self.linhas
+            total = min(total, self.linhas)
+            for i in range(total):
+                valores_linha = []
+                peso = 1.0
+                resto = i
+                for nome, valores in zip(dimensoes, opcoes):
+                    if valores:
+                        resto, j = divmod(resto, len(valores))
+                        valor = valores[j]
+                        if nome == "eventName" and valor in EVENTOS:
+                            peso *= 0.6 ** EVENTOS.index(valor)
+                    else:
+                        resto, j = divmod(resto, self.linhas)
+                        valor = f"{nome} {j + 1}"
+                    valores_linha.append(valor)
+                if varios:
+                    valores_linha.append(intervalo.name or f"date_range_{k}")
+                linhas.append((valores_linha, [_valor_metrica(m, t, rnd, peso) for m, t in zip(metricas, tipos)]))
+
+        for ordem in reversed(request.order_bys):
+            if "metric" in ordem and ordem.metric.metric_name in metricas:
+                i = metricas.index(ordem.metric.metric_name)
+                linhas.sort(key=lambda linha: float(linha[1][i]), reverse=ordem.desc)
+            elif "dimension" in ordem and ordem.dimension.dimension_name in dimensoes:
+                i = dimensoes.index(ordem.dimension.dimension_name)
+                linhas.sort(key=lambda linha: linha[0][i], reverse=ordem.desc)
+
+        inicio = getattr(request, "offset", 0) or 0
+        pagina = linhas[inicio:inicio + request.limit] if request.limit else linhas[inicio:]
+        return tipo_resposta(
+            dimension_headers=[DimensionHeader(name=d) for d in dimensoes + (["dateRange"] if varios else [])],
+            metric_headers=[MetricHeader(name=m, type_=t) for m, t in zip(metricas, tipos)],
+            rows=[
+                Row(dimension_values=[DimensionValue(value=v) for v in valores],
+                    metric_values=[MetricValue(value=v) for v in metricas_linha])
+                for valores, metricas_linha in pagina
+            ],
+            row_count=len(linhas)
+        )
+
+    def _com_cota(self, request, resposta):
+        if not request.return_property_quota:
+            return resposta
+        return type(resposta)(resposta, property_quota=PropertyQuota.pb(self._cota(len(resposta.rows))))
+
+    def _cota(self, n_linhas):
+        # Custo cresce com o tamanho da resposta; o saldo zera a cada hora cheia
+        custo = CUSTO_BASE_TOKENS + n_linhas // 1000
+        with self._lock:
+            hora = int(time.time() // 3600)
+            if hora != self._hora:
+                self._hora, self._consumido = hora, 0
+            self._consumido += custo
+            restante = max(self.tokens_por_hora - self._consumido, 0)
+        return PropertyQuota(tokens_per_hour=QuotaStatus(consumed=custo, remaining=restante))
+
+
+# === GRAVAÇÃO E REPRODUÇÃO ===
+def caminho_fixture(diretorio, metodo, request):
+    """Arquivo da resposta gravada para a requisição (serializada, sem o pedido de cota)."""
+    chave = hashlib.sha256(_serializar(request, "return_property_quota")).hexdigest()[:32]
+    return os.path.join(diretorio, f"{metodo}-{chave}.pb")
+
+
+class ClienteGA4Gravador:
+    """Repassa as chamadas ao cliente real e grava cada resposta como fixture."""
+
+    def __init__(self, cliente, diretorio=GA4_FIXTURES_DIR):
+        self.cliente = cliente
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _gravar(self, metodo, request, resposta):
+        caminho = caminho_fixture(self.diretorio, metodo, request)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(type(resposta).serialize(resposta))
+        os.replace(temporario, caminho)
+
+    def run_report(self, request=None, **kwargs):
+        resposta = self.cliente.run_report(request=request, **kwargs)
+        self._gravar("run_report", RunReportRequest(request), resposta)
+        return resposta
+
+    def batch_run_reports(self, request=None, **kwargs):
+        resposta = self.cliente.batch_run_reports(request=request, **kwargs)
+        # Cada relatório do lote vira uma fixture própria: a reprodução não
+        # depende de como as requisições foram agrupadas
+        for sub, relatorio in zip(request.requests, resposta.reports):
+            self._gravar("run_report", sub, relatorio)
+        return resposta
+
+    def run_realtime_report(self, request=None, **kwargs):
+        resposta = self.cliente.run_realtime_report(request=request, **kwargs)
+        self._gravar("run_realtime_report", RunRealtimeReportRequest(request), resposta)
+        return resposta
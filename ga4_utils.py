@@ -1,20 +1,95 @@
-import os
+import copy
+import json
+import time
+import logging
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import streamlit as st  # Adicionado para uso do cache
+from config import nomes_amigaveis, GA4_MODO, GA4_FIXTURES_DIR
+from google.oauth2 import service_account
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
+from google.analytics.data_v1beta.services.beta_analytics_data.transports.grpc import BetaAnalyticsDataGrpcTransport
+from cache_utils import (
+    TTL_PADRAO, JANELA_OBSOLETA, ttl_periodo, hoje_na_propriedade, cache_por_periodo,
+    ler_relatorio, gravar_relatorio, ler_particao, gravar_particao
+)
+from cota_utils import agendador, segundo_plano, CotaEsgotadaError
+from resiliencia_utils import disjuntor_ga4, disjuntor_tempo_real, chamar_com_resiliencia, GA4IndisponivelError
+from ga4_simulado import ClienteGA4Simulado, ClienteGA4Gravador
+from metricas_utils import registrar, contar, medir
 from google.analytics.data_v1beta.types import (
-    RunReportRequest, DateRange, Dimension, Metric,
-    FilterExpression, Filter, FilterExpressionList
+    RunReportRequest, BatchRunReportsRequest, DateRange, Dimension, Metric,
+    FilterExpression, Filter, FilterExpressionList, OrderBy, MetricType,
+    RunRealtimeReportRequest, MinuteRange
 )
 
+logger = logging.getLogger(__name__)
+
+# === CLIENTE GA4 COMPARTILHADO ===
+# Um único cliente (e um único canal gRPC) por processo, reutilizado por todas
+# as sessões e threads. O canal gRPC é thread-safe e multiplexa as chamadas.
+ESCOPOS_GA4 = ["https://www.googleapis.com/auth/analytics.readonly"]
+OPCOES_CANAL_GA4 = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.max_receive_message_length", 64 * 1024 * 1024),
+]
+
+_cliente_ga4 = None
+_lock_cliente = threading.Lock()
+_estatisticas_cliente = {"clientes_criados": 0, "reutilizacoes": 0}
+
+
+def _carregar_credenciais():
+    """Lê a service account direto do st.secrets, sem gravar arquivo em disco."""
+    info = st.secrets["GOOGLE_SERVICE_ACCOUNT"]
+    if isinstance(info, str):
+        info = json.loads(info)
+    return service_account.Credentials.from_service_account_info(dict(info), scopes=ESCOPOS_GA4)
+
+
+def _criar_cliente_ga4():
+    # GA4_MODO troca o cliente real pelo simulado (ga4_simulado) sem mudar nenhum fetch_*
+    if GA4_MODO == "simulado":
+        return ClienteGA4Simulado()
+    if GA4_MODO == "reproduzir":
+        return ClienteGA4Simulado(fixtures=GA4_FIXTURES_DIR)
+    credenciais = _carregar_credenciais()
+    canal = BetaAnalyticsDataGrpcTransport.create_channel(
+        credentials=credenciais,
+        scopes=ESCOPOS_GA4,
+        options=OPCOES_CANAL_GA4
+    )
+    cliente = BetaAnalyticsDataClient(transport=BetaAnalyticsDataGrpcTransport(channel=canal))
+    if GA4_MODO == "gravar":
+        return ClienteGA4Gravador(cliente, GA4_FIXTURES_DIR)
+    return cliente
+
+
 def get_ga4_client():
-    with open("/tmp/service_account.json", "w") as f:
-        f.write(st.secrets["GOOGLE_SERVICE_ACCOUNT"])
+    global _cliente_ga4
+    with _lock_cliente:
+        if _cliente_ga4 is None:
+            _cliente_ga4 = _criar_cliente_ga4()
+            _estatisticas_cliente["clientes_criados"] += 1
+        else:
+            _estatisticas_cliente["reutilizacoes"] += 1
+        return _cliente_ga4
 
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/tmp/service_account.json"
 
-    from google.analytics.data_v1beta import BetaAnalyticsDataClient
-    return BetaAnalyticsDataClient()
+def estatisticas_cliente_ga4():
+    """Retorna quantos clientes foram criados e quantas vezes o cliente foi reutilizado."""
+    with _lock_cliente:
+        return dict(_estatisticas_cliente)
+
+
+DIMENSAO_CLIENTE = "customUser:customer_root"
 
 
 def build_customer_filter(customer_root):
@@ -22,392 +97,852 @@ def build_customer_filter(customer_root):
         return None
     return FilterExpression(
         filter=Filter(
-            field_name="customUser:customer_root",
+            field_name=DIMENSAO_CLIENTE,
             string_filter=Filter.StringFilter(value=customer_root)
         )
     )
 
 
+def _cliente_da_requisicao(request):
+    """customer_root do filtro da requisição, ou None quando ela cobre todos os clientes."""
+    pendentes = [request.dimension_filter]
+    while pendentes:
+        expressao = pendentes.pop()
+        if expressao.filter.field_name == DIMENSAO_CLIENTE:
+            return expressao.filter.string_filter.value
+        pendentes.extend(expressao.and_group.expressions)
+    return None
 
-# === FUNÇÕES ===
-@st.cache_data(ttl=3600)
-def fetch_ga4_kpis(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[],
-        metrics=[
-            Metric(name="totalRevenue"),
-            Metric(name="conversions"),
-            Metric(name="sessionConversionRate"),
-            Metric(name="averagePurchaseRevenue")
-        ],
-        dimension_filter=filtro
-    )
-    response = client.run_report(request=request)
-    row = response.rows[0].metric_values if response.rows else [0]*4
-    return {
-        "receita_total": float(row[0].value),
-        "vendas": int(row[1].value),
-        "taxa_conversao": float(row[2].value),
-        "ticket_medio": float(row[3].value)
-    }
 
-@st.cache_data(ttl=3600)
-def fetch_receita_transacoes_por_dia(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="date")],
-        metrics=[
-            Metric(name="conversions"),
-            Metric(name="totalRevenue")
-        ],
-        limit=1000,
-        dimension_filter=filtro
-    )
-    response = client.run_report(request=request)
-    data = []
-    for row in response.rows:
-        data.append({
-            "Data": row.dimension_values[0].value,
-            "Conversões": int(row.metric_values[0].value),
-            "Receita": float(row.metric_values[1].value)
-        })
-    df = pd.DataFrame(data)
-    df["Data"] = pd.to_datetime(df["Data"])
-    return df.sort_values("Data")
 
-@st.cache_data(ttl=3600)
-def fetch_origem_conversoes(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
+# === EXECUÇÃO EM LOTE ===
+# A Data API aceita até 5 relatórios da mesma propriedade por batchRunReports.
+# As requisições que não estão no cache são agrupadas e os grupos rodam em
+# paralelo; cada fetch_* recebe a sua resposta como se tivesse feito o
+# próprio run_report. Toda chamada passa pelo agendador de cota (cota_utils),
+# por isso os grupos também são separados por cliente.
+TAMANHO_LOTE = 5
+# Lotes simultâneos por processo (a Data API limita requisições concorrentes por propriedade)
+MAX_LOTES_SIMULTANEOS = 4
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="sessionSourceMedium")],
-        metrics=[
-            Metric(name="sessions"),
-            Metric(name="conversions"),
-            Metric(name="totalRevenue"),
-            Metric(name="sessionConversionRate")
-        ],
-        limit=50,
-        dimension_filter=filtro
-    )
+_executor_lotes = ThreadPoolExecutor(max_workers=MAX_LOTES_SIMULTANEOS, thread_name_prefix="ga4-lote")
+
+
+def chave_requisicao(request):
+    """Hash canônico da requisição: o mesmo relatório gera sempre a mesma chave."""
+    conteudo = json.dumps(RunReportRequest.to_dict(request), sort_keys=True)
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
 
-    response = client.run_report(request=request)
 
-    data = [
-        [row.dimension_values[0].value] + [val.value for val in row.metric_values]
-        for row in response.rows
+def _chamar_ga4(client, propriedade, requests):
+    # Prazo, novas tentativas e disjuntor ficam em resiliencia_utils; retry=None
+    # desliga o retry próprio do cliente para não repetir em dobro
+    requests = [RunReportRequest(r, return_property_quota=True) for r in requests]
+    inicio = time.perf_counter()
+    if len(requests) == 1:
+        respostas = [chamar_com_resiliencia(
+            disjuntor_ga4, lambda prazo: client.run_report(request=requests[0], timeout=prazo, retry=None)
+        )]
+    else:
+        lote = BatchRunReportsRequest(property=propriedade, requests=requests)
+        respostas = list(chamar_com_resiliencia(
+            disjuntor_ga4, lambda prazo: client.batch_run_reports(request=lote, timeout=prazo, retry=None)
+        ).reports)
+    # Cada relatório do lote esperou a chamada inteira
+    duracao = time.perf_counter() - inicio
+    for request, resposta in zip(requests, respostas):
+        relatorio = _rotulo_relatorio(request)
+        registrar("ga4_segundos", duracao, relatorio=relatorio)
+        registrar("ga4_linhas", len(resposta.rows), relatorio=relatorio)
+    return respostas
+
+
+def _rotulo_relatorio(request):
+    """Rótulo estável do relatório nas métricas: as dimensões pedidas."""
+    return ",".join(d.name for d in request.dimensions) or "totais"
+
+
+def _executar_grupo(client, propriedade, cliente, requests, custo):
+    respostas = _chamar_ga4(client, propriedade, requests)
+    agendador.registrar(propriedade, cliente, custo, respostas)
+    return respostas
+
+
+def executar_em_lote(requests):
+    """Executa as requisições em grupos de até TAMANHO_LOTE por propriedade e cliente.
+
+    Os grupos rodam em paralelo no pool limitado do processo. Devolve as
+    respostas na mesma ordem das requisições.
+    """
+    client = get_ga4_client()
+    por_propriedade = {}
+    for i, request in enumerate(requests):
+        por_propriedade.setdefault((request.property, _cliente_da_requisicao(request)), []).append(i)
+
+    grupos = [
+        (propriedade, cliente, indices[inicio:inicio + TAMANHO_LOTE])
+        for (propriedade, cliente), indices in por_propriedade.items()
+        for inicio in range(0, len(indices), TAMANHO_LOTE)
     ]
+    # A cota é reservada aqui, na thread da sessão: quem espera por cota não
+    # ocupa um worker do pool, que só recebe chamadas já liberadas.
+    if len(grupos) == 1:
+        propriedade, cliente, grupo = grupos[0]
+        custo = agendador.reservar(propriedade, cliente, len(grupo))
+        resultados = [_executar_grupo(client, propriedade, cliente, [requests[i] for i in grupo], custo)]
+    else:
+        futuros = []
+        for propriedade, cliente, grupo in grupos:
+            custo = agendador.reservar(propriedade, cliente, len(grupo))
+            futuros.append(_executor_lotes.submit(
+                _executar_grupo, client, propriedade, cliente, [requests[i] for i in grupo], custo
+            ))
+        resultados = [f.result() for f in futuros]
+
+    respostas = [None] * len(requests)
+    for (_, _, grupo), relatorios in zip(grupos, resultados):
+        for i, relatorio in zip(grupo, relatorios):
+            respostas[i] = relatorio
+    return respostas
+
+
+def executar_relatorios(requests):
+    """Executa as requisições em lote, enviando cada requisição repetida uma única vez."""
+    chaves = [chave_requisicao(r) for r in requests]
+    unicas = dict(zip(chaves, requests))
+    respostas = dict(zip(unicas.keys(), executar_em_lote(list(unicas.values()))))
+    return [respostas[c] for c in chaves]
+
+
+def executar_relatorio(request):
+    return executar_relatorios([request])[0]
+
+
+# === PAGINAÇÃO ===
+# Relatórios grandes são lidos em páginas de offset/limit; cada página vira um
+# bloco de DataFrame e a resposta bruta é descartada antes da próxima.
+TAMANHO_PAGINA = 10000
+
+
+def _limite_pagina(max_linhas):
+    return min(TAMANHO_PAGINA, max_linhas) if max_linhas else TAMANHO_PAGINA
+
+
+# === DECODIFICAÇÃO ===
+# Um único decodificador para todas as respostas: lê os cabeçalhos e o tipo de
+# cada métrica e monta as colunas de uma vez, direto do protobuf. Contagens
+# viram int32 (int64 se não couberem), moeda fica em float64 para não perder
+# centavos e as demais métricas (taxas, médias) viram float32. A dimensão
+# date vira datetime; as outras dimensões viram category (ver _tipar_dimensoes).
+LIMITE_INT32 = np.iinfo(np.int32).max
+
+
+def _coluna_metrica(valores, tipo):
+    if tipo == MetricType.TYPE_INTEGER:
+        coluna = np.array(valores, dtype=np.int64)
+        if not len(coluna) or np.abs(coluna).max() <= LIMITE_INT32:
+            coluna = coluna.astype(np.int32)
+        return coluna
+    if tipo == MetricType.TYPE_CURRENCY:
+        return np.array(valores, dtype=np.float64)
+    return np.array(valores, dtype=np.float32)
+
+
+def _coluna_dimensao(valores, nome):
+    if nome == "date":
+        return pd.to_datetime(pd.Series(valores, dtype=object), format="%Y%m%d")
+    return valores
+
 
-    df = pd.DataFrame(data, columns=["Origem / Mídia", "Sessões", "Conversões", "Receita", "Taxa de Conversão"])
-    df.iloc[:, 1:] = df.iloc[:, 1:].apply(pd.to_numeric, errors="coerce")
+def _resposta_para_df(response):
+    """DataFrame tipado de uma resposta do GA4, uma coluna por dimensão/métrica."""
+    pb = type(response).pb(response)
+    colunas = {}
+    for i, header in enumerate(pb.dimension_headers):
+        colunas[header.name] = _coluna_dimensao([row.dimension_values[i].value for row in pb.rows], header.name)
+    for i, header in enumerate(pb.metric_headers):
+        colunas[header.name] = _coluna_metrica([row.metric_values[i].value for row in pb.rows], header.type_)
+    return pd.DataFrame(colunas)
+
+
+def _tipar_dimensoes(df):
+    """Converte as dimensões de texto em category (depois de juntar páginas/partições)."""
+    for coluna in df.columns:
+        if df[coluna].dtype == object or pd.api.types.is_string_dtype(df[coluna].dtype):
+            df[coluna] = df[coluna].astype("category")
     return df
 
-@st.cache_data(ttl=3600)
-def fetch_funil_conversao(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
-    eventos = ["session_start", "add_to_cart", "begin_checkout", "purchase"]
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="eventName")],
-        metrics=[Metric(name="eventCount")],
-        limit=100,
-        dimension_filter=filtro
-    )
+def _juntar(blocos):
+    return _tipar_dimensoes(pd.concat(blocos, ignore_index=True))
 
-    response = client.run_report(request=request)
-    data = {e: 0 for e in eventos}
 
-    for row in response.rows:
-        nome_evento = row.dimension_values[0].value
-        if nome_evento in data:
-            data[nome_evento] = int(row.metric_values[0].value)
+def _razao(numerador, denominador, escala=1):
+    """numerador / denominador * escala, coluna a coluna, com 0 onde o denominador é 0."""
+    numerador = np.asarray(numerador, dtype=np.float64)
+    denominador = np.asarray(denominador, dtype=np.float64)
+    resultado = np.zeros(len(numerador), dtype=np.float64)
+    np.divide(numerador * escala, denominador, out=resultado, where=denominador > 0)
+    return resultado
 
-    return {
-        "sessao": data["session_start"],
-        "carrinho": data["add_to_cart"],
-        "checkout": data["begin_checkout"],
-        "compra": data["purchase"]
-    }
 
+def _rotular_vazios(serie, rotulo):
+    """Troca a dimensão vazia ("") por um rótulo legível, mantendo category."""
+    return serie.astype(str).replace("", rotulo).astype("category")
 
-@st.cache_data(ttl=3600)
-def fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="itemName")],
-        metrics=[
-            Metric(name="itemRevenue"),
-            Metric(name="itemsPurchased")
-        ],
-        limit=50,
-        dimension_filter=filtro
-    )
+def iterar_paginas(request, max_linhas=None, primeira_resposta=None):
+    """Percorre o relatório página a página, gerando um DataFrame por página.
 
-    response = client.run_report(request=request)
+    Para ao atingir max_linhas ou o total de linhas do relatório (row_count).
+    """
+    lidas = 0
+    offset = request.offset
+    response = primeira_resposta
+    while True:
+        if response is None:
+            pagina = RunReportRequest(request)
+            pagina.offset = offset
+            pagina.limit = _limite_pagina(max_linhas - lidas if max_linhas else None)
+            response = executar_relatorio(pagina)
 
-    data = []
-    for row in response.rows:
-        nome = row.dimension_values[0].value
-        receita = float(row.metric_values[0].value)
-        quantidade = int(row.metric_values[1].value)
-        ticket_medio = receita / quantidade if quantidade > 0 else 0
-        data.append([nome, quantidade, receita, ticket_medio])
+        bloco = _resposta_para_df(response)
+        if max_linhas:
+            bloco = bloco.head(max_linhas - lidas)
+        lidas += len(bloco)
+        offset += len(response.rows)
+        yield bloco
 
-    df = pd.DataFrame(data, columns=["Produto", "Quantidade Vendida", "Receita (R$)", "Ticket Médio (R$)"])
-    return df.sort_values("Receita (R$)", ascending=False)
+        if not response.rows or offset >= response.row_count or (max_linhas and lidas >= max_linhas):
+            return
+        response = None
 
-@st.cache_data(ttl=3600)
-def fetch_categorias_mais_vendidas(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="itemCategory")],
-        metrics=[
-            Metric(name="itemRevenue"),
-            Metric(name="itemsPurchased")
-        ],
-        limit=50,
-        dimension_filter=filtro
-    )
+def _max_linhas_efetivo(request, max_linhas):
+    # Requisições com limit menor que uma página são relatórios "top N" de
+    # tamanho fixo; as demais são paginadas até o fim, salvo limite explícito.
+    if max_linhas:
+        return max_linhas
+    if 0 < request.limit < TAMANHO_PAGINA:
+        return request.limit
+    return None
 
-    response = client.run_report(request=request)
 
-    data = []
-    for row in response.rows:
-        categoria = row.dimension_values[0].value or "Sem categoria"
-        receita = float(row.metric_values[0].value)
-        quantidade = int(row.metric_values[1].value)
-        ticket_medio = receita / quantidade if quantidade > 0 else 0
-        data.append([categoria, quantidade, receita, ticket_medio])
+def _chave_consulta(request, max_linhas):
+    return chave_requisicao(request) + (f"-{max_linhas}" if max_linhas else "")
 
-    df = pd.DataFrame(data, columns=["Categoria", "Quantidade Vendida", "Receita (R$)", "Ticket Médio (R$)"])
-    return df.sort_values("Receita (R$)", ascending=False)
 
-@st.cache_data(ttl=3600)
-def fetch_tecnologia_usuarios(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
+# === PARTIÇÕES DIÁRIAS ===
+# Relatórios com a dimensão date são guardados como uma partição imutável por
+# dia (por cliente e formato de relatório). Ao deslocar o período, só os dias
+# ausentes ou ainda em processamento no GA4 (ver ttl_periodo) são buscados de novo.
 
-    req_dispositivos = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="deviceCategory")],
-        metrics=[Metric(name="sessions")],
-        limit=10,
-        dimension_filter=filtro
-    )
 
-    req_sistemas = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="operatingSystem")],
-        metrics=[Metric(name="sessions")],
-        limit=10,
-        dimension_filter=filtro
-    )
+def _dias_do_relatorio(request):
+    """Dias cobertos por um relatório diário, ou None se ele não for particionável."""
+    if len(request.date_ranges) != 1 or not any(d.name == "date" for d in request.dimensions):
+        return None
+    try:
+        inicio = date.fromisoformat(request.date_ranges[0].start_date)
+        fim = date.fromisoformat(request.date_ranges[0].end_date)
+    except ValueError:
+        return None
+    fim = min(fim, hoje_na_propriedade())
+    return [inicio + timedelta(days=n) for n in range((fim - inicio).days + 1)]
 
-    res_disp = client.run_report(request=req_dispositivos)
-    res_sist = client.run_report(request=req_sistemas)
 
-    df_disp = pd.DataFrame([{
-        "Categoria": row.dimension_values[0].value.title(),
-        "Sessões": int(row.metric_values[0].value)
-    } for row in res_disp.rows])
+def _chave_serie(request):
+    # Mesma série para qualquer período: o hash ignora datas e paginação
+    base = RunReportRequest(request)
+    base.date_ranges = []
+    base.offset = 0
+    base.limit = 0
+    return chave_requisicao(base)
 
-    df_sist = pd.DataFrame([{
-        "Sistema": row.dimension_values[0].value,
-        "Sessões": int(row.metric_values[0].value)
-    } for row in res_sist.rows])
 
-    return df_disp, df_sist
+def _ttl_requisicao(request):
+    # A validade segue o fim mais recente entre os períodos da requisição
+    fins = [faixa.end_date for faixa in request.date_ranges]
+    return ttl_periodo(max(fins)) if fins else TTL_PADRAO
 
-@st.cache_data(ttl=3600)
-def fetch_regioes_mais_acessadas(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="region"), Dimension(name="city")],
-        metrics=[Metric(name="sessions")],
-        limit=500,
-        dimension_filter=filtro
-    )
+def _blocos_contiguos(dias):
+    blocos = []
+    for dia in dias:
+        if blocos and dia - blocos[-1][-1] == timedelta(days=1):
+            blocos[-1].append(dia)
+        else:
+            blocos.append([dia])
+    return blocos
 
-    response = client.run_report(request=request)
 
-    data = []
-    for row in response.rows:
-        regiao = row.dimension_values[0].value or "Não definida"
-        cidade = row.dimension_values[1].value or "Não definida"
-        sessoes = int(row.metric_values[0].value)
-        data.append([regiao, cidade, sessoes])
+def _requisicao_periodo(request, inicio, fim):
+    copia = RunReportRequest(request)
+    copia.date_ranges = [DateRange(start_date=inicio.isoformat(), end_date=fim.isoformat())]
+    copia.offset = 0
+    copia.limit = TAMANHO_PAGINA
+    return copia
 
-    df = pd.DataFrame(data, columns=["Região", "Cidade", "Acessos"])
-    return df.sort_values("Acessos", ascending=False)
 
-@st.cache_data(ttl=3600)
-def fetch_engajamento_site(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
+def _buscar_relatorios(requests, limites):
+    """Busca no GA4: primeira página de todas as requisições em lote, demais por paginação."""
+    primeiras = executar_relatorios(requests)
+    return [
+        _juntar(list(iterar_paginas(request, limite, response)))
+        for request, limite, response in zip(requests, limites, primeiras)
+    ]
+
 
-    request = RunReportRequest(
+def _gravar_buscas(buscas, resultados, tabelas, particoes):
+    for chave, df in zip(buscas.keys(), resultados):
+        if isinstance(chave, str):
+            # Marca o que acabou de vir do GA4 (em oposição a leituras do disco)
+            df.attrs["criado_em"] = gravar_relatorio(chave, df)
+            df.attrs["buscado_no_ga4"] = True
+            tabelas[chave] = df
+            continue
+        serie, inicio, fim = chave
+        for n in range((fim - inicio).days + 1):
+            dia = inicio + timedelta(days=n)
+            parte = df[df["date"] == pd.Timestamp(dia)].reset_index(drop=True)
+            gravar_particao(serie, dia.strftime("%Y%m%d"), parte)
+            particoes[serie, dia] = parte
+
+
+def _ler_sem_validade(buscas, tabelas, particoes):
+    """Última versão gravada de cada busca, vencida ou não; False se faltar alguma."""
+    # Lida com a validade normal e janela sem fim: o dado volta marcado como
+    # obsoleto, com o vencimento real, e não é guardado em memória como novo
+    for chave, (request, _) in buscas.items():
+        if isinstance(chave, str):
+            tabelas[chave] = ler_relatorio(chave, ttl=_ttl_requisicao(request), janela_obsoleta=float("inf"))
+            if tabelas[chave] is None:
+                return False
+            continue
+        serie, inicio, fim = chave
+        for n in range((fim - inicio).days + 1):
+            dia = inicio + timedelta(days=n)
+            particoes[serie, dia] = ler_particao(
+                serie, dia.strftime("%Y%m%d"), ttl=ttl_periodo(dia.isoformat()), janela_obsoleta=float("inf")
+            )
+            if particoes[serie, dia] is None:
+                return False
+    return True
+
+
+# === REVALIDAÇÃO EM SEGUNDO PLANO ===
+# Entradas expiradas há menos de JANELA_OBSOLETA são servidas na hora e
+# buscadas de novo numa thread à parte, com prioridade de segundo plano na
+# cota. Cada chave é revalidada por uma única thread de cada vez.
+_executor_revalidacao = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ga4-revalidar")
+_revalidando = set()
+_lock_revalidacao = threading.Lock()
+
+
+def _revalidar(buscas):
+    try:
+        with segundo_plano():
+            resultados = _buscar_relatorios(
+                [request for request, _ in buscas.values()],
+                [limite for _, limite in buscas.values()]
+            )
+        _gravar_buscas(buscas, resultados, {}, {})
+    except Exception:
+        logger.warning("Falha ao revalidar %d relatório(s) do GA4", len(buscas), exc_info=True)
+    finally:
+        with _lock_revalidacao:
+            _revalidando.difference_update(buscas)
+
+
+def _revalidar_em_segundo_plano(buscas):
+    with _lock_revalidacao:
+        novas = {chave: busca for chave, busca in buscas.items() if chave not in _revalidando}
+        _revalidando.update(novas)
+    if novas:
+        _executor_revalidacao.submit(_revalidar, novas)
+
+
+def consultar_relatorios(requests, max_linhas=None):
+    """Devolve um DataFrame por requisição, lendo do cache persistente quando possível.
+
+    Tudo o que não está no cache (relatórios inteiros ou dias de séries diárias)
+    é buscado de uma vez, em lote, e gravado no cache. Entradas recém-expiradas
+    são devolvidas como estão e revalidadas em segundo plano; se o GA4 estiver
+    indisponível, vale a última versão gravada. As colunas têm os nomes das
+    dimensões e métricas do GA4, já tipadas por _resposta_para_df.
+    """
+    limites = [_max_linhas_efetivo(r, max_linhas) for r in requests]
+    planos = []
+    tabelas = {}
+    particoes = {}
+    buscas = {}
+    revalidacoes = {}
+
+    for request, limite in zip(requests, limites):
+        dias = _dias_do_relatorio(request)
+        if dias is None:
+            chave = _chave_consulta(request, limite)
+            if chave not in tabelas:
+                tabelas[chave] = ler_relatorio(chave, ttl=_ttl_requisicao(request), janela_obsoleta=JANELA_OBSOLETA)
+                if tabelas[chave] is None:
+                    buscas[chave] = (request, limite)
+                    contar("cache_disco", tipo="relatorio", resultado="falta")
+                elif tabelas[chave].attrs.get("obsoleto"):
+                    revalidacoes[chave] = (request, limite)
+                    contar("cache_disco", tipo="relatorio", resultado="obsoleto")
+                else:
+                    contar("cache_disco", tipo="relatorio", resultado="acerto")
+            planos.append((chave, None, limite))
+            continue
+
+        serie = _chave_serie(request)
+        for dia in dias:
+            if (serie, dia) not in particoes:
+                particoes[serie, dia] = ler_particao(
+                    serie, dia.strftime("%Y%m%d"), ttl=ttl_periodo(dia.isoformat()), janela_obsoleta=JANELA_OBSOLETA
+                )
+        ausentes = [dia for dia in dias if particoes[serie, dia] is None]
+        for bloco in _blocos_contiguos(ausentes):
+            buscas[serie, bloco[0], bloco[-1]] = (_requisicao_periodo(request, bloco[0], bloco[-1]), None)
+        obsoletos = [
+            dia for dia in dias
+            if particoes[serie, dia] is not None and particoes[serie, dia].attrs.get("obsoleto")
+        ]
+        for bloco in _blocos_contiguos(obsoletos):
+            revalidacoes[serie, bloco[0], bloco[-1]] = (_requisicao_periodo(request, bloco[0], bloco[-1]), None)
+        contar("cache_disco", len(ausentes), tipo="dia", resultado="falta")
+        contar("cache_disco", len(obsoletos), tipo="dia", resultado="obsoleto")
+        contar("cache_disco", len(dias) - len(ausentes) - len(obsoletos), tipo="dia", resultado="acerto")
+        planos.append((serie, dias, limite))
+
+    if buscas:
+        try:
+            resultados = _buscar_relatorios(
+                [request for request, _ in buscas.values()],
+                [limite for _, limite in buscas.values()]
+            )
+        except (GA4IndisponivelError, CotaEsgotadaError):
+            if not _ler_sem_validade(buscas, tabelas, particoes):
+                raise
+            logger.warning("GA4 indisponível; servindo %d relatório(s) vencido(s) do cache", len(buscas))
+        else:
+            _gravar_buscas(buscas, resultados, tabelas, particoes)
+    if revalidacoes:
+        _revalidar_em_segundo_plano(revalidacoes)
+
+    saida = []
+    for (chave, dias, limite), request in zip(planos, requests):
+        if dias is None:
+            saida.append(tabelas[chave])
+            continue
+        if dias:
+            df = _juntar([particoes[chave, dia] for dia in dias])
+        else:
+            df = pd.DataFrame(columns=[d.name for d in request.dimensions] + [m.name for m in request.metrics])
+        saida.append(df.head(limite) if limite else df)
+    return saida
+
+
+def consultar_relatorio(request, max_linhas=None):
+    return consultar_relatorios([request], max_linhas)[0]
+
+
+# === REQUISIÇÕES ===
+def _requisicao(property_id, start_date, end_date, customer_root, dimensions, metrics, limit=None,
+                dimension_filter=None, order_by=None, desc=True):
+    if order_by in dimensions:
+        order_bys = [OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name=order_by), desc=desc)]
+    elif order_by:
+        order_bys = [OrderBy(metric=OrderBy.MetricOrderBy(metric_name=order_by), desc=desc)]
+    else:
+        order_bys = []
+    return RunReportRequest(
         property=f"properties/{property_id}",
         date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="date")],
-        metrics=[
-            Metric(name="sessions"),
-            Metric(name="totalUsers"),
-            Metric(name="newUsers"),
-            Metric(name="screenPageViews"),
-            Metric(name="engagementRate")
-        ],
-        limit=1000,
-        dimension_filter=filtro
+        dimensions=[Dimension(name=d) for d in dimensions],
+        metrics=[Metric(name=m) for m in metrics],
+        limit=limit,
+        order_bys=order_bys,
+        dimension_filter=dimension_filter if dimension_filter is not None else build_customer_filter(customer_root)
     )
 
-    response = client.run_report(request=request)
-
-    data = []
-    for row in response.rows:
-        data.append({
-            "Data": row.dimension_values[0].value,
-            "Acessos Totais": int(row.metric_values[0].value),
-            "Usuários Totais": int(row.metric_values[1].value),
-            "Novos Usuários": int(row.metric_values[2].value),
-            "Visualizações de Página": int(row.metric_values[3].value),
-            "Taxa de Engajamento (%)": float(row.metric_values[4].value) * 100
-        })
-
-    df = pd.DataFrame(data)
-    df["Data"] = pd.to_datetime(df["Data"], format="%Y%m%d")
-    return df
 
+def _req_kpis(property_id, start_date, end_date, customer_root=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, [],
+                       ["totalRevenue", "conversions", "sessionConversionRate", "averagePurchaseRevenue"])
 
-@st.cache_data(ttl=3600)
-def fetch_paginas_mais_acessadas(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="pagePath")],
-        metrics=[
-            Metric(name="screenPageViews"),
-            Metric(name="sessions"),
-            Metric(name="engagementRate")
-        ],
-        limit=25,
-        dimension_filter=filtro
-    )
+def _req_receita_por_dia(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["date"],
+                       ["conversions", "totalRevenue"], limit=_limite_pagina(max_linhas),
+                       order_by="date", desc=False)
 
-    response = client.run_report(request=request)
 
-    data = []
-    for row in response.rows:
-        data.append({
-            "Página": row.dimension_values[0].value,
-            "Visualizações": int(row.metric_values[0].value),
-            "Sessões": int(row.metric_values[1].value),
-            "Taxa de Engajamento (%)": float(row.metric_values[2].value) * 100
-        })
+def _req_origem_conversoes(property_id, start_date, end_date, customer_root=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["sessionSourceMedium"],
+                       ["sessions", "conversions", "totalRevenue", "sessionConversionRate"], limit=50)
 
-    return pd.DataFrame(data).sort_values("Visualizações", ascending=False)
 
-@st.cache_data(ttl=3600)
-def fetch_conversoes_por_canal(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro = build_customer_filter(customer_root)
+def _req_produtos_mais_vendidos(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["itemName"],
+                       ["itemRevenue", "itemsPurchased"], limit=_limite_pagina(max_linhas),
+                       order_by="itemRevenue")
 
-    request = RunReportRequest(
-        property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="sessionDefaultChannelGroup")],
-        metrics=[
-            Metric(name="sessions"),
-            Metric(name="conversions"),
-            Metric(name="totalRevenue")
-        ],
-        limit=25,
-        dimension_filter=filtro
+
+def _req_categorias_mais_vendidas(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["itemCategory"],
+                       ["itemRevenue", "itemsPurchased"], limit=_limite_pagina(max_linhas),
+                       order_by="itemRevenue")
+
+
+def _req_dispositivos(property_id, start_date, end_date, customer_root=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["deviceCategory"],
+                       ["sessions"], limit=10)
+
+
+def _req_sistemas(property_id, start_date, end_date, customer_root=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["operatingSystem"],
+                       ["sessions"], limit=10)
+
+
+def _req_regioes(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["region", "city"],
+                       ["sessions"], limit=_limite_pagina(max_linhas), order_by="sessions")
+
+
+def _req_engajamento(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["date"],
+                       ["sessions", "totalUsers", "newUsers", "screenPageViews", "engagementRate"],
+                       limit=_limite_pagina(max_linhas), order_by="date", desc=False)
+
+
+def _req_paginas(property_id, start_date, end_date, customer_root=None, max_linhas=25):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["pagePath"],
+                       ["screenPageViews", "sessions", "engagementRate"], limit=_limite_pagina(max_linhas),
+                       order_by="screenPageViews")
+
+
+def _req_canais(property_id, start_date, end_date, customer_root=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["sessionDefaultChannelGroup"],
+                       ["sessions", "conversions", "totalRevenue"], limit=25)
+
+
+# Eventos do motor de contagem: a união do que os funis, o carrinho e o ranking usam
+EVENTOS_CONTADOS = ("session_start", "add_to_cart", "begin_checkout", "purchase")
+EVENTOS_FUNIL = {"sessao": "session_start", "carrinho": "add_to_cart", "checkout": "begin_checkout", "compra": "purchase"}
+EVENTOS_ABANDONO = ["add_to_cart", "begin_checkout", "purchase"]
+
+
+def _filtro_eventos(eventos, customer_root):
+    """eventName em uma lista de eventos (um único filtro), mais o filtro do cliente."""
+    filtro = FilterExpression(
+        filter=Filter(field_name="eventName", in_list_filter=Filter.InListFilter(values=list(eventos)))
     )
+    if not customer_root:
+        return filtro
+    return FilterExpression(and_group=FilterExpressionList(expressions=[filtro, build_customer_filter(customer_root)]))
 
-    response = client.run_report(request=request)
 
-    data = []
-    for row in response.rows:
-        canal = row.dimension_values[0].value
-        sessoes = int(row.metric_values[0].value)
-        conversoes = int(row.metric_values[1].value)
-        receita = float(row.metric_values[2].value)
-        taxa_conv = (conversoes / sessoes * 100) if sessoes > 0 else 0
-        data.append([canal, sessoes, conversoes, receita, taxa_conv])
+def _req_contagem_eventos(property_id, start_date, end_date, customer_root=None, eventos=EVENTOS_CONTADOS):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["eventName"],
+                       ["eventCount"], dimension_filter=_filtro_eventos(eventos, customer_root))
 
-    return pd.DataFrame(data, columns=["Canal", "Sessões", "Conversões", "Receita (R$)", "Taxa de Conversão (%)"]).sort_values("Receita (R$)", ascending=False)
 
-@st.cache_data(ttl=3600)
-def fetch_funil_abandono(property_id, start_date, end_date, customer_root=None):
-    from google.analytics.data_v1beta import BetaAnalyticsDataClient
-    from google.analytics.data_v1beta.types import (
-        RunReportRequest, DateRange, Dimension, Metric,
-        FilterExpression, Filter
+def _req_produtos_abandonados(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    return _requisicao(property_id, start_date, end_date, customer_root, ["itemName"],
+                       ["itemsAddedToCart"], limit=_limite_pagina(max_linhas),
+                       dimension_filter=_filtro_eventos(["add_to_cart"], customer_root),
+                       order_by="itemsAddedToCart")
+
+
+# === PERÍODOS DE COMPARAÇÃO ===
+PERIODOS_COMPARACAO = ("atual", "anterior", "ano_anterior")
+
+
+def periodo_anterior(start_date, end_date):
+    """Período imediatamente anterior, com o mesmo número de dias."""
+    inicio_dt = datetime.strptime(start_date, "%Y-%m-%d")
+    fim_dt = datetime.strptime(end_date, "%Y-%m-%d")
+    dias = (fim_dt - inicio_dt).days + 1
+    inicio_ant = (inicio_dt - timedelta(days=dias)).strftime("%Y-%m-%d")
+    fim_ant = (inicio_dt - timedelta(days=1)).strftime("%Y-%m-%d")
+    return inicio_ant, fim_ant
+
+
+def periodo_ano_anterior(start_date, end_date):
+    """Mesmo período do ano anterior (29/02 vira 28/02)."""
+    def um_ano_antes(data_str):
+        data = date.fromisoformat(data_str)
+        try:
+            return data.replace(year=data.year - 1).isoformat()
+        except ValueError:
+            return data.replace(year=data.year - 1, day=28).isoformat()
+    return um_ano_antes(start_date), um_ano_antes(end_date)
+
+
+def atalhos_periodo(hoje):
+    """Intervalos rápidos do seletor de período, como (início, fim) em date."""
+    primeiro_do_mes = hoje.replace(day=1)
+    fim_mes_anterior = primeiro_do_mes - timedelta(days=1)
+    return {
+        "Hoje": (hoje, hoje),
+        "Ontem": (hoje - timedelta(days=1), hoje - timedelta(days=1)),
+        "Últimos 7 dias": (hoje - timedelta(days=6), hoje),
+        "Últimos 30 dias": (hoje - timedelta(days=29), hoje),
+        "Este mês": (primeiro_do_mes, hoje),
+        "Mês anterior": (fim_mes_anterior.replace(day=1), fim_mes_anterior)
+    }
+
+
+def periodos_comparacao(start_date, end_date):
+    return {
+        "atual": (start_date, end_date),
+        "anterior": periodo_anterior(start_date, end_date),
+        "ano_anterior": periodo_ano_anterior(start_date, end_date)
+    }
+
+
+def _req_comparativo(construir, property_id, start_date, end_date, customer_root=None):
+    """Mesma requisição de construir, com os três períodos como DateRanges nomeados.
+
+    O GA4 acrescenta a dimensão dateRange às linhas, com o nome do período.
+    """
+    request = construir(property_id, start_date, end_date, customer_root)
+    request.date_ranges = [
+        DateRange(start_date=inicio, end_date=fim, name=nome)
+        for nome, (inicio, fim) in periodos_comparacao(start_date, end_date).items()
+    ]
+    if 0 < request.limit < TAMANHO_PAGINA:
+        request.limit *= len(PERIODOS_COMPARACAO)
+    return request
+
+
+# Requisições que cada fetch_* faz, na ordem em que as consome.
+RELATORIOS = {
+    "fetch_ga4_kpis": [_req_kpis],
+    "fetch_receita_transacoes_por_dia": [_req_receita_por_dia],
+    "fetch_origem_conversoes": [_req_origem_conversoes],
+    "fetch_funil_conversao": [_req_contagem_eventos],
+    "fetch_produtos_mais_vendidos": [_req_produtos_mais_vendidos],
+    "fetch_categorias_mais_vendidas": [_req_categorias_mais_vendidas],
+    "fetch_tecnologia_usuarios": [_req_dispositivos, _req_sistemas],
+    "fetch_regioes_mais_acessadas": [_req_regioes],
+    "fetch_engajamento_site": [_req_engajamento],
+    "fetch_paginas_mais_acessadas": [_req_paginas],
+    "fetch_conversoes_por_canal": [_req_canais],
+    "fetch_funil_abandono": [_req_contagem_eventos],
+    "fetch_produtos_abandonados": [_req_produtos_abandonados],
+    "fetch_kpis_comparativo": [partial(_req_comparativo, _req_kpis)],
+    "fetch_canais_comparativo": [partial(_req_comparativo, _req_canais)],
+    "fetch_produtos_comparativo": [partial(_req_comparativo, _req_produtos_mais_vendidos)],
+}
+
+
+def requisicoes_relatorios(nomes, property_id, start_date, end_date, customer_root=None):
+    return [
+        construir(property_id, start_date, end_date, customer_root)
+        for nome in nomes
+        for construir in RELATORIOS[nome]
+    ]
+
+
+def pre_carregar_relatorios(property_id, start_date, end_date, customer_root=None, relatorios=None):
+    """Busca de uma vez, em lotes paralelos, os relatórios que as abas vão usar.
+
+    relatorios é uma lista de nomes de fetch_* (chaves de RELATORIOS); sem
+    ela, todos são carregados. Os resultados vão para o cache persistente,
+    de onde os fetch_* passam a lê-los.
+    """
+    if relatorios is None:
+        relatorios = list(RELATORIOS)
+    consultar_relatorios(requisicoes_relatorios(relatorios, property_id, start_date, end_date, customer_root))
+
+
+COLUNAS_KPIS = {
+    "totalRevenue": "receita_total",
+    "conversions": "vendas",
+    "sessionConversionRate": "taxa_conversao",
+    "averagePurchaseRevenue": "ticket_medio"
+}
+
+
+def _kpis_de_linha(row):
+    return {
+        "receita_total": float(row["totalRevenue"]),
+        "vendas": int(float(row["conversions"])),
+        "taxa_conversao": float(row["sessionConversionRate"]),
+        "ticket_medio": float(row["averagePurchaseRevenue"])
+    }
+
+
+def _df_produtos(df):
+    return pd.DataFrame({
+        "Produto": df["itemName"],
+        "Quantidade Vendida": df["itemsPurchased"],
+        "Receita (R$)": df["itemRevenue"],
+        "Ticket Médio (R$)": _razao(df["itemRevenue"], df["itemsPurchased"])
+    })
+
+
+def _df_canais(df):
+    return pd.DataFrame({
+        "Canal": df["sessionDefaultChannelGroup"],
+        "Sessões": df["sessions"],
+        "Conversões": df["conversions"].astype(np.int32),
+        "Receita (R$)": df["totalRevenue"],
+        "Taxa de Conversão (%)": _razao(df["conversions"].astype(np.int32), df["sessions"], 100)
+    })
+
+
+def _comparativo(df, transformar):
+    tidy = transformar(df)
+    tidy.insert(0, "Período", df["dateRange"].values)
+    return tidy
+
+
+# === FUNÇÕES ===
+@cache_por_periodo
+def fetch_ga4_kpis(property_id, start_date, end_date, customer_root=None):
+    df = consultar_relatorio(_req_kpis(property_id, start_date, end_date, customer_root))
+    if df.empty:
+        return {"receita_total": 0.0, "vendas": 0, "taxa_conversao": 0.0, "ticket_medio": 0.0}
+    return _kpis_de_linha(df.iloc[0])
+
+@cache_por_periodo
+def fetch_receita_transacoes_por_dia(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(
+        _req_receita_por_dia(property_id, start_date, end_date, customer_root, max_linhas), max_linhas
     )
-    import pandas as pd
+    df = pd.DataFrame({
+        "Data": df["date"],
+        "Conversões": df["conversions"].astype(np.int32),
+        "Receita": df["totalRevenue"]
+    })
+    return df.sort_values("Data")
 
-    client = get_ga4_client()
+@cache_por_periodo
+def fetch_origem_conversoes(property_id, start_date, end_date, customer_root=None):
+    df = consultar_relatorio(_req_origem_conversoes(property_id, start_date, end_date, customer_root))
+    return pd.DataFrame({
+        "Origem / Mídia": df["sessionSourceMedium"],
+        "Sessões": df["sessions"],
+        "Conversões": df["conversions"],
+        "Receita": df["totalRevenue"],
+        "Taxa de Conversão": df["sessionConversionRate"]
+    })
+
+# === CONTAGEM DE EVENTOS ===
+# Funil de conversão, funil de abandono e ranking leem as contagens do mesmo
+# relatório: eventName × eventCount com um único filtro in-list sobre
+# EVENTOS_CONTADOS. Cada contagem fica em cache uma vez por cliente e
+# período, em vez de um relatório por evento em cada função.
+@cache_por_periodo
+def fetch_contagem_eventos(property_id, start_date, end_date, customer_root=None):
+    df = consultar_relatorio(_req_contagem_eventos(property_id, start_date, end_date, customer_root))
+    contagens = df.groupby("eventName", observed=True)["eventCount"].sum()
+    return {evento: int(contagens.get(evento, 0)) for evento in EVENTOS_CONTADOS}
+
+
+def contagem_eventos(property_id, start_date, end_date, customer_root=None, eventos=EVENTOS_CONTADOS):
+    """Contagem de cada evento pedido; os de EVENTOS_CONTADOS vêm do relatório compartilhado."""
+    contagens = fetch_contagem_eventos(property_id, start_date, end_date, customer_root)
+    extras = sorted(set(eventos) - set(EVENTOS_CONTADOS))
+    if extras:
+        df = consultar_relatorio(_req_contagem_eventos(property_id, start_date, end_date, customer_root, extras))
+        por_evento = df.groupby("eventName", observed=True)["eventCount"].sum()
+        contagens.update({evento: int(por_evento.get(evento, 0)) for evento in extras})
+    return {evento: contagens[evento] for evento in eventos}
+
+
+@cache_por_periodo
+def fetch_funil_conversao(property_id, start_date, end_date, customer_root=None):
+    contagens = contagem_eventos(property_id, start_date, end_date, customer_root)
+    return {etapa: contagens[evento] for etapa, evento in EVENTOS_FUNIL.items()}
 
-    def fetch_event_count(event_name):
-        filtro_evento = FilterExpression(
-            filter=Filter(
-                field_name="eventName",
-                string_filter=Filter.StringFilter(value=event_name)
-            )
-        )
 
-        filtro_final = filtro_evento
-        if customer_root:
-            filtro_cliente = build_customer_filter(customer_root)
-            filtro_final = FilterExpression(
-                and_group=FilterExpressionList(expressions=[filtro_evento, filtro_cliente])
-            )
+@cache_por_periodo
+def fetch_produtos_mais_vendidos(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(
+        _req_produtos_mais_vendidos(property_id, start_date, end_date, customer_root, max_linhas), max_linhas
+    )
+    return _df_produtos(df).sort_values("Receita (R$)", ascending=False)
 
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-            dimensions=[Dimension(name="eventName")],
-            metrics=[Metric(name="eventCount")],
-            dimension_filter=filtro_final
-        )
+@cache_por_periodo
+def fetch_categorias_mais_vendidas(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(
+        _req_categorias_mais_vendidas(property_id, start_date, end_date, customer_root, max_linhas), max_linhas
+    )
+    df = pd.DataFrame({
+        "Categoria": _rotular_vazios(df["itemCategory"], "Sem categoria"),
+        "Quantidade Vendida": df["itemsPurchased"],
+        "Receita (R$)": df["itemRevenue"],
+        "Ticket Médio (R$)": _razao(df["itemRevenue"], df["itemsPurchased"])
+    })
+    return df.sort_values("Receita (R$)", ascending=False)
 
-        response = client.run_report(request=request)
-        total = sum(int(row.metric_values[0].value) for row in response.rows) if response.rows else 0
-        return total
+@cache_por_periodo
+def fetch_tecnologia_usuarios(property_id, start_date, end_date, customer_root=None):
+    # Dispositivos e sistemas saem de um único batchRunReports
+    res_disp, res_sist = consultar_relatorios([
+        _req_dispositivos(property_id, start_date, end_date, customer_root),
+        _req_sistemas(property_id, start_date, end_date, customer_root)
+    ])
+
+    df_disp = pd.DataFrame({
+        "Categoria": res_disp["deviceCategory"].cat.rename_categories(str.title),
+        "Sessões": res_disp["sessions"]
+    })
+
+    df_sist = pd.DataFrame({
+        "Sistema": res_sist["operatingSystem"],
+        "Sessões": res_sist["sessions"]
+    })
 
-    add = fetch_event_count("add_to_cart")
-    checkout = fetch_event_count("begin_checkout")
-    compra = fetch_event_count("purchase")
+    return df_disp, df_sist
+
+@cache_por_periodo
+def fetch_regioes_mais_acessadas(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(_req_regioes(property_id, start_date, end_date, customer_root, max_linhas), max_linhas)
+    df = pd.DataFrame({
+        "Região": _rotular_vazios(df["region"], "Não definida"),
+        "Cidade": _rotular_vazios(df["city"], "Não definida"),
+        "Acessos": df["sessions"]
+    })
+    return df.sort_values("Acessos", ascending=False)
+
+@cache_por_periodo
+def fetch_engajamento_site(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(_req_engajamento(property_id, start_date, end_date, customer_root, max_linhas), max_linhas)
+    return pd.DataFrame({
+        "Data": df["date"],
+        "Acessos Totais": df["sessions"],
+        "Usuários Totais": df["totalUsers"],
+        "Novos Usuários": df["newUsers"],
+        "Visualizações de Página": df["screenPageViews"],
+        "Taxa de Engajamento (%)": df["engagementRate"] * 100
+    })
+
+
+@cache_por_periodo
+def fetch_paginas_mais_acessadas(property_id, start_date, end_date, customer_root=None, max_linhas=25):
+    df = consultar_relatorio(_req_paginas(property_id, start_date, end_date, customer_root, max_linhas), max_linhas)
+    df = pd.DataFrame({
+        "Página": df["pagePath"],
+        "Visualizações": df["screenPageViews"],
+        "Sessões": df["sessions"],
+        "Taxa de Engajamento (%)": df["engagementRate"] * 100
+    })
+    return df.sort_values("Visualizações", ascending=False)
+
+@cache_por_periodo
+def fetch_conversoes_por_canal(property_id, start_date, end_date, customer_root=None):
+    df = consultar_relatorio(_req_canais(property_id, start_date, end_date, customer_root))
+    return _df_canais(df).sort_values("Receita (R$)", ascending=False)
+
+@cache_por_periodo
+def fetch_funil_abandono(property_id, start_date, end_date, customer_root=None):
+    contagens = contagem_eventos(property_id, start_date, end_date, customer_root, EVENTOS_ABANDONO)
+    add, checkout, compra = (contagens[evento] for evento in EVENTOS_ABANDONO)
 
     taxa_abandono_carrinho = max(min(((add - checkout) / add) * 100, 100), 0) if add else 0
     taxa_abandono_checkout = ((checkout - compra) / checkout * 100) if checkout else 0
@@ -420,46 +955,215 @@ def fetch_funil_abandono(property_id, start_date, end_date, customer_root=None):
         "taxa_abandono_checkout": taxa_abandono_checkout
     }
 
-@st.cache_data(ttl=3600)
-def fetch_produtos_abandonados(property_id, start_date, end_date, customer_root=None):
-    client = get_ga4_client()
-    filtro_evento = FilterExpression(
-        filter=Filter(
-            field_name="eventName",
-            string_filter=Filter.StringFilter(
-                value="add_to_cart",
-                match_type=Filter.StringFilter.MatchType.EXACT
-            )
-        )
+@cache_por_periodo
+def fetch_produtos_abandonados(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    df = consultar_relatorio(
+        _req_produtos_abandonados(property_id, start_date, end_date, customer_root, max_linhas), max_linhas
+    )
+    df = pd.DataFrame({
+        "Produto": df["itemName"],
+        "Adições ao Carrinho": df["itemsAddedToCart"]
+    })
+    return df.sort_values(by="Adições ao Carrinho", ascending=False)
+
+
+# === COMPARATIVOS (atual, anterior e ano anterior numa só requisição) ===
+@cache_por_periodo
+def fetch_kpis_comparativo(property_id, start_date, end_date, customer_root=None):
+    """KPIs por período, indexados por "atual", "anterior" e "ano_anterior"."""
+    df = consultar_relatorio(_req_comparativo(_req_kpis, property_id, start_date, end_date, customer_root))
+    por_periodo = {row["dateRange"]: _kpis_de_linha(row) for _, row in df.iterrows()}
+    vazio = {"receita_total": 0.0, "vendas": 0, "taxa_conversao": 0.0, "ticket_medio": 0.0}
+    tidy = pd.DataFrame.from_dict(
+        {periodo: por_periodo.get(periodo, vazio) for periodo in PERIODOS_COMPARACAO}, orient="index"
     )
+    tidy.index.name = "Período"
+    return tidy
+
+
+def kpis_do_periodo(comparativo, periodo="atual"):
+    """Linha de fetch_kpis_comparativo no formato de fetch_ga4_kpis."""
+    row = comparativo.loc[periodo]
+    return {
+        "receita_total": float(row["receita_total"]),
+        "vendas": int(row["vendas"]),
+        "taxa_conversao": float(row["taxa_conversao"]),
+        "ticket_medio": float(row["ticket_medio"])
+    }
+
+
+@cache_por_periodo
+def fetch_canais_comparativo(property_id, start_date, end_date, customer_root=None):
+    """Canais por período, em formato longo (coluna "Período")."""
+    df = consultar_relatorio(_req_comparativo(_req_canais, property_id, start_date, end_date, customer_root))
+    return _comparativo(df, _df_canais).sort_values("Receita (R$)", ascending=False)
+
+
+@cache_por_periodo
+def fetch_produtos_comparativo(property_id, start_date, end_date, customer_root=None, max_linhas=None):
+    """Produtos vendidos por período, em formato longo (coluna "Período")."""
+    df = consultar_relatorio(
+        _req_comparativo(partial(_req_produtos_mais_vendidos, max_linhas=max_linhas),
+                         property_id, start_date, end_date, customer_root),
+        max_linhas
+    )
+    return _comparativo(df, _df_produtos).sort_values("Receita (R$)", ascending=False)
+
+
+# === RANKING DE CLIENTES (todos os clientes num só relatório) ===
+# customer_root entra como dimensão em vez de filtro: um relatório traz os
+# números de todos os clientes. Cada fatia é gravada no cache persistente
+# com a chave da requisição filtrada daquele cliente, então trocar de
+# cliente no seletor depois disso não vai mais ao GA4. Além dos relatórios
+# do próprio ranking, vão no mesmo lote os comparativos de KPIs e canais,
+# que são o que Resumo, Vendas e Canais leem para cada cliente.
+CONSTRUTORES_RANKING = [
+    _req_kpis, _req_canais, _req_contagem_eventos,
+    partial(_req_comparativo, _req_kpis), partial(_req_comparativo, _req_canais)
+]
+
+
+def _req_por_cliente(construir, property_id, start_date, end_date, customer_root=None):
+    request = construir(property_id, start_date, end_date, None)
+    request.dimensions.append(Dimension(name=DIMENSAO_CLIENTE))
+    if request.limit:
+        request.limit = TAMANHO_PAGINA
+    return request
+
+
+# O ranking ignora customer_root: um único relatório cobre todos os clientes
+RELATORIOS["fetch_ranking_clientes"] = [partial(_req_por_cliente, construir) for construir in CONSTRUTORES_RANKING]
+
+
+def _distribuir_por_cliente(construir, property_id, start_date, end_date, df):
+    """Grava no cache a fatia de cada cliente como se fosse o relatório filtrado dele.
+
+    Só vale para um relatório que acabou de vir do GA4, e a fatia leva o instante
+    dele: uma entrada vencida do disco (revalidação ou GA4 fora do ar) não pode
+    reaparecer como nova nos relatórios de cada cliente.
+    """
+    if not df.attrs.get("buscado_no_ga4"):
+        return
+    for cliente in nomes_amigaveis:
+        request = construir(property_id, start_date, end_date, cliente)
+        limite = _max_linhas_efetivo(request, None)
+        fatia = df[df[DIMENSAO_CLIENTE] == cliente].drop(columns=DIMENSAO_CLIENTE).reset_index(drop=True)
+        # Sem ordenação no GA4, um relatório limitado só é equivalente se couber inteiro
+        if limite and len(fatia) > limite and not request.order_bys:
+            continue
+        gravar_relatorio(_chave_consulta(request, limite), fatia.head(limite) if limite else fatia, df.attrs["criado_em"])
+
+
+@cache_por_periodo
+def fetch_ranking_clientes(property_id, start_date, end_date):
+    """KPIs, canais e funil de todos os clientes em um único lote de relatórios.
+
+    Devolve (ranking, canais): ranking com uma linha por cliente e canais em
+    formato longo (Cliente, Canal, Sessões, Conversões, Receita...).
+    """
+    tabelas = consultar_relatorios(
+        requisicoes_relatorios(["fetch_ranking_clientes"], property_id, start_date, end_date)
+    )
+    for construir, df in zip(CONSTRUTORES_RANKING, tabelas):
+        _distribuir_por_cliente(construir, property_id, start_date, end_date, df)
+    df_kpis, df_canais, df_funil = tabelas[:3]
+
+    ranking = pd.DataFrame([
+        {"customer_root": row[DIMENSAO_CLIENTE], **_kpis_de_linha(row)} for _, row in df_kpis.iterrows()
+    ], columns=["customer_root", "receita_total", "vendas", "taxa_conversao", "ticket_medio"])
+
+    canais = _df_canais(df_canais)
+    canais.insert(0, "customer_root", df_canais[DIMENSAO_CLIENTE].values)
+    top_canal = canais.sort_values("Receita (R$)", ascending=False).drop_duplicates("customer_root")
+    ranking = ranking.merge(
+        top_canal[["customer_root", "Canal"]].rename(columns={"Canal": "Canal principal"}),
+        on="customer_root", how="left"
+    )
+
+    eventos = {"session_start": "Sessões", "add_to_cart": "Carrinhos", "begin_checkout": "Checkouts", "purchase": "Compras"}
+    funil = df_funil[df_funil["eventName"].isin(eventos)].astype({"eventName": str, DIMENSAO_CLIENTE: str})
+    funil = funil.pivot_table(index=DIMENSAO_CLIENTE, columns="eventName", values="eventCount", aggfunc="sum")
+    funil = funil.reindex(columns=list(eventos), fill_value=0).rename(columns=eventos).fillna(0).astype(int)
+    ranking = ranking.merge(funil, left_on="customer_root", right_index=True, how="left")
+
+    ranking = ranking[ranking["customer_root"].isin(nomes_amigaveis)]
+    canais = canais[canais["customer_root"].isin(nomes_amigaveis)]
+    ranking.insert(0, "Cliente", ranking["customer_root"].map(nomes_amigaveis))
+    canais.insert(0, "Cliente", canais["customer_root"].map(nomes_amigaveis))
+    ranking = ranking.rename(columns={
+        "receita_total": "Receita (R$)", "vendas": "Vendas",
+        "taxa_conversao": "Taxa de Conversão", "ticket_medio": "Ticket Médio (R$)"
+    })
+    return (
+        ranking.sort_values("Receita (R$)", ascending=False).reset_index(drop=True),
+        canais.drop(columns="customer_root").reset_index(drop=True)
+    )
+
+
+# === TEMPO REAL (atalho "Hoje") ===
+# Painel ao vivo com a API de tempo real do GA4: usuários ativos, funil e
+# usuários por minuto dos últimos MINUTOS_TEMPO_REAL minutos. A API de tempo
+# real tem cota própria, então não passa pelo agendador, e disjuntor próprio
+# (disjuntor_tempo_real), para não suspender os relatórios; as sessões que
+# acompanham o mesmo cliente dividem uma consulta a cada TTL_TEMPO_REAL
+# segundos. Uma falha não é repetida: a próxima atualização já tenta de novo.
+TTL_TEMPO_REAL = 20
+MINUTOS_TEMPO_REAL = 30
+PRAZO_TEMPO_REAL = 10
+_tempo_real = {}
+_lock_tempo_real = threading.Lock()
 
-    if customer_root:
-        filtro_custom = build_customer_filter(customer_root)
-        filtro_final = FilterExpression(
-            and_group=FilterExpressionList(
-                expressions=[filtro_custom, filtro_evento]
-            )
-        )
-    else:
-        filtro_final = filtro_evento
 
-    request = RunReportRequest(
+def _req_tempo_real(property_id, customer_root, dimensions, metrics, dimension_filter=None):
+    return RunRealtimeReportRequest(
         property=f"properties/{property_id}",
-        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-        dimensions=[Dimension(name="itemName")],
-        metrics=[Metric(name="itemsAddedToCart")],
-        limit=100,
-        dimension_filter=filtro_final
+        dimensions=[Dimension(name=d) for d in dimensions],
+        metrics=[Metric(name=m) for m in metrics],
+        minute_ranges=[MinuteRange(start_minutes_ago=MINUTOS_TEMPO_REAL - 1, end_minutes_ago=0)],
+        dimension_filter=dimension_filter if dimension_filter is not None else build_customer_filter(customer_root)
     )
 
-    response = client.run_report(request=request)
 
-    dados = []
-    for row in response.rows:
-        produto = row.dimension_values[0].value
-        adicoes = int(row.metric_values[0].value)
-        dados.append({"Produto": produto, "Adições ao Carrinho": adicoes})
+def _consultar_tempo_real(client, request):
+    with medir("ga4_segundos", relatorio="tempo_real"):
+        resposta = chamar_com_resiliencia(
+            disjuntor_tempo_real,
+            lambda prazo: client.run_realtime_report(request=request, timeout=prazo, retry=None),
+            tentativas=1, prazo_tentativa=PRAZO_TEMPO_REAL, prazo_total=PRAZO_TEMPO_REAL
+        )
+    return _resposta_para_df(resposta)
+
 
-    return pd.DataFrame(dados).sort_values(by="Adições ao Carrinho", ascending=False)
+def fetch_tempo_real(property_id, customer_root=None):
+    """Totais, funil e usuários por minuto dos últimos MINUTOS_TEMPO_REAL minutos."""
+    chave = (property_id, customer_root)
+    with _lock_tempo_real:
+        entrada = _tempo_real.get(chave)
+        if entrada and time.monotonic() - entrada[0] < TTL_TEMPO_REAL:
+            return copy.deepcopy(entrada[1])
 
+    client = get_ga4_client()
+    requests = [
+        _req_tempo_real(property_id, customer_root, [], ["activeUsers", "screenPageViews"]),
+        _req_tempo_real(property_id, customer_root, ["eventName"], ["eventCount"],
+                        _filtro_eventos(EVENTOS_FUNIL.values(), customer_root)),
+        _req_tempo_real(property_id, customer_root, ["minutesAgo"], ["activeUsers"])
+    ]
+    df_totais, df_eventos, df_minutos = _executor_lotes.map(partial(_consultar_tempo_real, client), requests)
+
+    contagens = df_eventos.groupby("eventName", observed=True)["eventCount"].sum()
+    por_minuto = pd.DataFrame({
+        "Minutos atrás": pd.to_numeric(df_minutos["minutesAgo"].astype(str)),
+        "Usuários ativos": df_minutos["activeUsers"]
+    }).sort_values("Minutos atrás", ascending=False)
+    dados = {
+        "usuarios_ativos": int(df_totais["activeUsers"].sum()),
+        "visualizacoes": int(df_totais["screenPageViews"].sum()),
+        "funil": {etapa: int(contagens.get(evento, 0)) for etapa, evento in EVENTOS_FUNIL.items()},
+        "por_minuto": por_minuto.reset_index(drop=True),
+        "obtido_em": time.time()
+    }
+    with _lock_tempo_real:
+        _tempo_real[chave] = (time.monotonic(), dados)
+    return copy.deepcopy(dados)
 
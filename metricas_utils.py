@@ -0,0 +1,185 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICAS_PORTA, METRICAS_ENDERECO
+
+logger = logging.getLogger(__name__)
+
+# === MÉTRICAS DE DESEMPENHO ===
+# Tempos (histogramas) e contadores do processo, com rótulos. O painel
+# administrativo mostra percentis das amostras dos últimos JANELA_METRICAS
+# segundos; o endpoint /metrics exporta os acumulados no formato do Prometheus.
+JANELA_METRICAS = 900
+MAX_AMOSTRAS = 2000          # por série, para a janela não crescer sem limite
+# Baldes do Prometheus: tempos (séries *_segundos) e quantidades (linhas, tokens)
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LIMITES_QUANTIDADE = (1, 10, 100, 1000, 10000, 100000, 250000)
+PREFIXO_PROMETHEUS = "dashboard_ga4"
+
+
+class _Serie:
+    def __init__(self, limites):
+        self.amostras = deque(maxlen=MAX_AMOSTRAS)
+        self.contagem = 0
+        self.soma = 0.0
+        self.limites = limites
+        self.baldes = [0] * len(limites)
+
+    def adicionar(self, valor, agora):
+        self.amostras.append((agora, valor))
+        self.contagem += 1
+        self.soma += valor
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.baldes[i] += 1
+
+
+def _percentil(ordenados, fracao):
+    return ordenados[min(int(fracao * len(ordenados)), len(ordenados) - 1)]
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._contadores = {}
+
+    def registrar(self, nome, valor, **rotulos):
+        """Adiciona uma amostra (segundos, linhas...) ao histograma nome/rótulos."""
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            if chave not in self._series:
+                self._series[chave] = _Serie(LIMITES_HISTOGRAMA if nome.endswith("_segundos") else LIMITES_QUANTIDADE)
+            self._series[chave].adicionar(float(valor), time.monotonic())
+
+    def contar(self, nome, quantidade=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + quantidade
+
+    @contextmanager
+    def medir(self, nome, **rotulos):
+        """Registra em nome o tempo do bloco; se o bloco falhar, conta também nome_erros."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.contar(f"{nome}_erros", **rotulos)
+            raise
+        finally:
+            self.registrar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def resumo(self, janela=JANELA_METRICAS):
+        """Percentis por série na janela e o total de cada contador."""
+        limite = time.monotonic() - janela
+        tempos = []
+        with self._lock:
+            for (nome, rotulos), serie in self._series.items():
+                valores = sorted(valor for instante, valor in serie.amostras if instante >= limite)
+                if not valores:
+                    continue
+                tempos.append({
+                    "metrica": nome, **dict(rotulos), "amostras": len(valores),
+                    "media": sum(valores) / len(valores), "p50": _percentil(valores, 0.5),
+                    "p95": _percentil(valores, 0.95), "p99": _percentil(valores, 0.99), "max": valores[-1]
+                })
+            contadores = [
+                {"metrica": nome, **dict(rotulos), "total": total}
+                for (nome, rotulos), total in self._contadores.items()
+            ]
+        return {"tempos": tempos, "contadores": contadores}
+
+    def taxa_acerto(self, nome, acertos=("memoria", "obsoleto", "acerto")):
+        """Fração das contagens de nome (rótulo resultado) que vieram do cache."""
+        with self._lock:
+            totais = [(dict(rotulos).get("resultado"), total)
+                      for (metrica, rotulos), total in self._contadores.items() if metrica == nome]
+        total = sum(n for _, n in totais)
+        return sum(n for resultado, n in totais if resultado in acertos) / total if total else None
+
+    def prometheus(self):
+        """Texto no formato de exposição do Prometheus (acumulados desde o início do processo)."""
+        def rotular(rotulos, extra=()):
+            pares = [
+                f'{chave}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                for chave, valor in list(rotulos) + list(extra)
+            ]
+            return "{" + ",".join(pares) + "}" if pares else ""
+
+        linhas = []
+        with self._lock:
+            por_nome = {}
+            for (nome, rotulos), serie in self._series.items():
+                por_nome.setdefault(nome, []).append((rotulos, serie))
+            for nome, series in sorted(por_nome.items()):
+                metrica = f"{PREFIXO_PROMETHEUS}_{nome}"
+                linhas.append(f"# TYPE {metrica} histogram")
+                for rotulos, serie in series:
+                    for limite, quantidade in zip(serie.limites, serie.baldes):
+                        linhas.append(f"{metrica}_bucket{rotular(rotulos, [('le', limite)])} {quantidade}")
+                    linhas.append(f"{metrica}_bucket{rotular(rotulos, [('le', '+Inf')])} {serie.contagem}")
+                    linhas.append(f"{metrica}_sum{rotular(rotulos)} {serie.soma}")
+                    linhas.append(f"{metrica}_count{rotular(rotulos)} {serie.contagem}")
+            por_nome = {}
+            for (nome, rotulos), total in self._contadores.items():
+                por_nome.setdefault(nome, []).append((rotulos, total))
+            for nome, contadores in sorted(por_nome.items()):
+                metrica = f"{PREFIXO_PROMETHEUS}_{nome}_total"
+                linhas.append(f"# TYPE {metrica} counter")
+                for rotulos, total in contadores:
+                    linhas.append(f"{metrica}{rotular(rotulos)} {total}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas()
+registrar = metricas.registrar
+contar = metricas.contar
+medir = metricas.medir
+
+
+def resumo_metricas():
+    """Tempos (percentis na janela) e contadores do processo."""
+    return metricas.resumo()
+
+
+# === ENDPOINT DE EXPORTAÇÃO ===
+_servidor = None
+_lock_servidor = threading.Lock()
+
+
+class _RespostaMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = metricas.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        logger.debug(formato, *args)
+
+
+def iniciar_servidor_metricas(porta=METRICAS_PORTA, endereco=METRICAS_ENDERECO):
+    """Sobe (uma vez por processo) o /metrics em segundo plano; porta 0 desliga."""
+    global _servidor
+    if not porta:
+        return None
+    with _lock_servidor:
+        if _servidor is None:
+            try:
+                _servidor = ThreadingHTTPServer((endereco, porta), _RespostaMetricas)
+            except OSError:
+                # Porta ocupada (outro processo já exporta): não tenta de novo a cada rerun
+                logger.warning("Não foi possível abrir o endpoint de métricas na porta %s", porta, exc_info=True)
+                _servidor = False
+                return None
+            _servidor.daemon_threads = True
+            threading.Thread(target=_servidor.serve_forever, name="metricas", daemon=True).start()
+        return _servidor or None
@@ -1,8 +1,16 @@
 
 import sqlite3
 import bcrypt
+import pandas as pd
 import streamlit as st
 from config import nomes_amigaveis
+from ga4_utils import estatisticas_cliente_ga4
+from cota_utils import estatisticas_cota
+from resiliencia_utils import estatisticas_resiliencia
+from metricas_utils import metricas, resumo_metricas, JANELA_METRICAS
+from cache_ia_utils import estatisticas_cache_ia, limpar_cache_ia
+from diagnostico_utils import estatisticas_modelos
+from config import METRICAS_PORTA
 
 def conectar():
     return sqlite3.connect("usuarios.db")
@@ -61,3 +69,63 @@ def painel_administrativo():
                 adicionar_usuario(nome, senha, cliente if cliente else None, tipo)
                 st.success(f"Usuário '{nome}' adicionado com sucesso!")
                 st.rerun()
+
+    st.markdown("---")
+    st.subheader("🔌 Conexão GA4")
+    stats = estatisticas_cliente_ga4()
+    col1, col2 = st.columns(2)
+    col1.metric("Clientes GA4 criados", stats["clientes_criados"])
+    col2.metric("Reutilizações do cliente", stats["reutilizacoes"])
+    disjuntor = estatisticas_resiliencia()
+    estados = {"fechado": "🟢 Normal", "meio_aberto": "🟡 Testando", "aberto": "🔴 Suspenso"}
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Circuito GA4", estados[disjuntor["estado"]])
+    col2.metric("Falhas seguidas", disjuntor["falhas_seguidas"])
+    col3.metric("Novas tentativas", disjuntor["novas_tentativas"])
+    col4.metric("Chamadas recusadas", disjuntor["recusadas"], f"{disjuntor['aberturas']} aberturas", delta_color="off")
+
+    st.subheader("⏱️ Cota GA4")
+    cota = estatisticas_cota()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Chamadas agendadas", cota["chamadas"])
+    col2.metric("Chamadas que esperaram cota", cota["esperas"], f"{cota['segundos_esperando']:.0f}s no total")
+    col3.metric("Recusadas por falta de cota", cota["recusadas"])
+    for propriedade, saldo in cota["propriedades"].items():
+        restante = saldo["restante_ga4"] if saldo["restante_ga4"] is not None else "n/d"
+        st.write(f"`{propriedade}`: {saldo['tokens_disponiveis']} tokens disponíveis "
+                 f"(saldo no GA4: {restante}, custo médio por relatório: {saldo['custo_medio']})")
+    if cota["consumo_por_cliente"]:
+        st.write("Tokens consumidos na última hora por cliente:")
+        st.bar_chart(cota["consumo_por_cliente"])
+
+    st.subheader("📈 Desempenho")
+    resumo = resumo_metricas()
+    col1, col2, col3 = st.columns(3)
+    for col, rotulo, nome in [(col1, "Acerto do cache em memória", "cache_memoria"),
+                              (col2, "Acerto do cache em disco", "cache_disco")]:
+        taxa = metricas.taxa_acerto(nome)
+        col.metric(rotulo, f"{taxa:.0%}" if taxa is not None else "n/d")
+    tokens = sum(c["total"] for c in resumo["contadores"] if c["metrica"] == "ga4_tokens")
+    col3.metric("Tokens GA4 consumidos", f"{tokens:,.0f}".replace(",", "."))
+    if resumo["tempos"]:
+        st.caption(f"Tempos (segundos) e linhas dos últimos {JANELA_METRICAS // 60} minutos")
+        tempos = pd.DataFrame(resumo["tempos"]).fillna("")
+        st.dataframe(tempos.sort_values(["metrica", "p95"], ascending=[True, False]), hide_index=True)
+    if resumo["contadores"]:
+        with st.expander("Contadores desde o início do processo"):
+            st.dataframe(pd.DataFrame(resumo["contadores"]).fillna(""), hide_index=True)
+    if METRICAS_PORTA:
+        st.caption(f"Exportação para o Prometheus em `:{METRICAS_PORTA}/metrics`.")
+
+    st.subheader("🤖 IA")
+    cache_ia = estatisticas_cache_ia()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Respostas guardadas", cache_ia["respostas"], f"{cache_ia['escopos']} períodos/clientes", delta_color="off")
+    taxa = metricas.taxa_acerto("cache_ia")
+    col2.metric("Acerto do cache da IA", f"{taxa:.0%}" if taxa is not None else "n/d")
+    if col3.button("🧹 Limpar cache da IA"):
+        st.success(f"{limpar_cache_ia()} respostas removidas.")
+    modelos = estatisticas_modelos()
+    if modelos:
+        st.caption("Modelos chamados por este processo (suspensos são pulados até o prazo acabar)")
+        st.dataframe(pd.DataFrame(modelos), hide_index=True)
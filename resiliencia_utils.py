@@ -0,0 +1,152 @@
+import time
+import random
+import threading
+from google.api_core import exceptions
+
+# === RESILIÊNCIA DAS CHAMADAS AO GA4 ===
+# Toda chamada ao GA4 tem prazo (timeout por tentativa e prazo total), é
+# repetida com backoff exponencial e jitter quando o erro é transitório, e
+# passa por um disjuntor: depois de FALHAS_PARA_ABRIR falhas seguidas o
+# circuito abre e as chamadas falham na hora por TEMPO_ABERTO segundos, em
+# vez de acumular threads bloqueadas durante uma indisponibilidade do GA4.
+# Passado esse tempo, uma única chamada de teste decide se o circuito fecha.
+PRAZO_TENTATIVA = 30
+PRAZO_TOTAL = 60
+TENTATIVAS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAXIMO = 8
+FALHAS_PARA_ABRIR = 5
+TEMPO_ABERTO = 30
+
+# Erros transitórios do servidor ou da rede; cota esgotada e erros da
+# requisição (argumento inválido, permissão) não adiantam repetir
+ERROS_REPETIVEIS = (
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.BadGateway,
+    exceptions.GatewayTimeout,
+    exceptions.Aborted,
+)
+
+
+class GA4IndisponivelError(RuntimeError):
+    """O GA4 não respondeu depois das novas tentativas."""
+
+
+class CircuitoAbertoError(GA4IndisponivelError):
+    """O disjuntor está aberto: o GA4 falhou seguidamente e a chamada nem foi feita."""
+
+
+class GA4RecusouError(GA4IndisponivelError):
+    """O GA4 respondeu com um erro que não adianta repetir (cota do GA4, permissão, requisição inválida)."""
+
+
+class Disjuntor:
+    def __init__(self, nome, falhas_para_abrir=FALHAS_PARA_ABRIR, tempo_aberto=TEMPO_ABERTO):
+        self.nome = nome
+        self.falhas_para_abrir = falhas_para_abrir
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto_em = None
+        self._testando = False
+        self._estatisticas = {"chamadas": 0, "novas_tentativas": 0, "falhas": 0, "recusadas": 0, "aberturas": 0}
+
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def _estado(self):
+        if self._aberto_em is None:
+            return "fechado"
+        if time.monotonic() - self._aberto_em < self.tempo_aberto:
+            return "aberto"
+        return "meio_aberto"
+
+    def liberar(self):
+        """Reserva a passagem de uma chamada ou levanta CircuitoAbertoError."""
+        with self._lock:
+            estado = self._estado()
+            # Meio aberto: só uma chamada de teste por vez
+            if estado == "aberto" or (estado == "meio_aberto" and self._testando):
+                self._estatisticas["recusadas"] += 1
+                raise CircuitoAbertoError(
+                    f"{self.nome} indisponível; novas chamadas suspensas por alguns segundos."
+                )
+            if estado == "meio_aberto":
+                self._testando = True
+            self._estatisticas["chamadas"] += 1
+
+    def sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._aberto_em = None
+            self._testando = False
+
+    def falha(self):
+        with self._lock:
+            self._falhas += 1
+            self._estatisticas["falhas"] += 1
+            if self._testando or self._falhas >= self.falhas_para_abrir:
+                if self._aberto_em is None or self._testando:
+                    self._estatisticas["aberturas"] += 1
+                self._aberto_em = time.monotonic()
+            self._testando = False
+
+    def nova_tentativa(self):
+        with self._lock:
+            self._estatisticas["novas_tentativas"] += 1
+
+    def estatisticas(self):
+        with self._lock:
+            return {"estado": self._estado(), "falhas_seguidas": self._falhas, **self._estatisticas}
+
+
+def _espera(tentativa):
+    # Backoff exponencial com "full jitter": espalha as novas tentativas de várias sessões
+    return random.uniform(0, min(BACKOFF_MAXIMO, BACKOFF_BASE * 2 ** tentativa))
+
+
+def chamar_com_resiliencia(disjuntor, chamada, tentativas=TENTATIVAS,
+                           prazo_tentativa=PRAZO_TENTATIVA, prazo_total=PRAZO_TOTAL):
+    """Executa chamada(timeout) com prazo, novas tentativas e disjuntor.
+
+    chamada recebe o timeout (segundos) da tentativa. Erros transitórios que
+    persistem viram GA4IndisponivelError, os demais erros da API viram
+    GA4RecusouError e o resto sobe como veio.
+    """
+    limite = time.monotonic() + prazo_total
+    for tentativa in range(tentativas):
+        disjuntor.liberar()
+        restante = limite - time.monotonic()
+        try:
+            resultado = chamada(min(prazo_tentativa, max(restante, 1)))
+        except ERROS_REPETIVEIS as erro:
+            disjuntor.falha()
+            espera = _espera(tentativa)
+            if tentativa + 1 >= tentativas or time.monotonic() + espera >= limite:
+                raise GA4IndisponivelError(f"{disjuntor.nome} não respondeu: {erro.message}") from erro
+            disjuntor.nova_tentativa()
+            time.sleep(espera)
+            continue
+        except exceptions.GoogleAPICallError as erro:
+            # Erro da própria requisição: o serviço respondeu, o circuito segue saudável.
+            # Vira GA4IndisponivelError para as abas e o cache vencido tratarem como falha do GA4
+            disjuntor.sucesso()
+            raise GA4RecusouError(f"{disjuntor.nome} recusou a consulta: {erro.message}") from erro
+        except Exception:
+            disjuntor.falha()
+            raise
+        disjuntor.sucesso()
+        return resultado
+
+
+disjuntor_ga4 = Disjuntor("GA4")
+# A API de tempo real tem cota e falhas próprias: não abre o circuito dos relatórios
+disjuntor_tempo_real = Disjuntor("GA4 tempo real")
+
+
+def estatisticas_resiliencia():
+    """Estado do disjuntor do GA4 e contagem de falhas e novas tentativas."""
+    return disjuntor_ga4.estatisticas()